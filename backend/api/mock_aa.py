@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Header
 from pydantic import BaseModel
 from uuid import uuid4
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 import random
 import sqlite3
@@ -10,6 +10,25 @@ import os
 
 DB_FILE = "mockaa.db"
 
+# ------------------------------
+# Timestamps
+# ------------------------------
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_us(value):
+    """ISO string or datetime -> microseconds since the epoch (naive = UTC)."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", ""))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
 # ------------------------------
 # Initialize SQLite
 # ------------------------------
@@ -41,10 +60,28 @@ def init_db():
         balance REAL,
         mode TEXT,
         merchant TEXT,
-        category TEXT
+        category TEXT,
+        valueTs INTEGER
     );
     """)
 
+    # valueDate as epoch microseconds, so fetch_data filters in SQL.
+    # Databases created before the column existed are backfilled here.
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(transactions)")}
+    if "valueTs" not in columns:
+        cur.execute("ALTER TABLE transactions ADD COLUMN valueTs INTEGER")
+
+    conn.create_function("to_epoch_us", 1, to_epoch_us, deterministic=True)
+    cur.execute("""
+        UPDATE transactions SET valueTs = to_epoch_us(valueDate)
+        WHERE valueTs IS NULL AND valueDate IS NOT NULL
+    """)
+
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_transactions_account_ts
+    ON transactions (accountId, valueTs);
+    """)
+
     cur.execute("""
     CREATE TABLE IF NOT EXISTS consents (
         consentHandle TEXT PRIMARY KEY,
@@ -256,8 +293,8 @@ def fetch_data(session_id: str):
     consent_req = json.loads(consent_json)
     consent_detail = consent_req["ConsentDetail"]
     vua = consent_detail["Customer"]["id"]
-    dr_from = parse_iso(consent_detail["DataRange"]["from"])
-    dr_to = parse_iso(consent_detail["DataRange"]["to"])
+    ts_from = to_epoch_us(parse_iso(consent_detail["DataRange"]["from"]))
+    ts_to = to_epoch_us(parse_iso(consent_detail["DataRange"]["to"]))
 
     # Find accounts for VUA
     cur.execute("SELECT accountId, fiType, fiSubType, fipId FROM accounts WHERE vua=?", (vua,))
@@ -268,15 +305,13 @@ def fetch_data(session_id: str):
     for acc in acc_rows:
         acc_id, fiType, fiSubType, fipId = acc
 
-        # Fetch transactions
-        cur.execute("SELECT txnId, amount, txnType, valueDate, txnDate, narration, reference, balance, mode, merchant, category FROM transactions WHERE accountId=?", (acc_id,))
-        rows = cur.fetchall()
-
-        filtered = []
-        for r in rows:
-            value_dt = parse_iso(r[3])
-            if dr_from <= value_dt <= dr_to:
-                filtered.append(r)
+        # Fetch transactions inside the consent's data range
+        cur.execute("""
+            SELECT txnId, amount, txnType, valueDate, txnDate, narration, reference, balance, mode, merchant, category
+            FROM transactions
+            WHERE accountId=? AND valueTs BETWEEN ? AND ?
+        """, (acc_id, ts_from, ts_to))
+        filtered = cur.fetchall()
 
         FI_list.append({
             "account": {
@@ -357,17 +392,18 @@ def mock_add_transaction(data: AddTransaction):
     else:
         balance += data.amount
 
-    value_dt = (datetime.utcnow() - timedelta(days=data.days_ago)).isoformat() + "Z"
+    value_at = datetime.utcnow() - timedelta(days=data.days_ago)
+    value_dt = value_at.isoformat() + "Z"
 
     txn_id = str(uuid4())
 
     cur.execute("""
         INSERT INTO transactions
-        (txnId, accountId, amount, txnType, valueDate, txnDate, narration, reference, balance, mode, merchant, category)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        (txnId, accountId, amount, txnType, valueDate, txnDate, narration, reference, balance, mode, merchant, category, valueTs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (txn_id, data.accountId, data.amount, data.txnType, value_dt, value_dt,
           data.narration, f"MOCKREF{random.randint(10000,99999)}",
-          balance, data.mode, data.merchant, data.category))
+          balance, data.mode, data.merchant, data.category, to_epoch_us(value_at)))
 
     conn.commit()
     conn.close()
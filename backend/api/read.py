@@ -9,7 +9,7 @@ def read_latest_transactions(limit=5):
     query = f"""
     SELECT txnId, accountId, amount, txnType, valueDate, narration, merchant, category
     FROM transactions
-    ORDER BY valueDate DESC
+    ORDER BY valueTs DESC
     LIMIT {limit};
     """
 
@@ -1,14 +1,50 @@
 import sqlite3
 import time
-from typing import List, Dict, Any
-
-from app.agent.loader import load_transactions
-from app.agent.categorizer import categorize_batch
-from app.agent.subscriptions import detect_subscriptions
-from app.agent.anomalies import detect_anomalies
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from app.agent.loader import (
+    Txn,
+    load_transactions,
+    iter_user_transactions,
+    load_history,
+    iter_user_histories,
+)
+from app.agent.catalog import build_catalog
+from app.agent.categorizer import categorize_stale, cache_stats, rules_version
+from app.agent.merchants import Merchant, load_merchants
+from app.agent.subscriptions import detect_subscriptions, load_subscriptions, rebuild_flagged_states
+from app.agent.anomalies import detect_anomalies, load_anomalies
 from app.agent.predictor import predict_future
 from app.agent.insights import generate_insights
+from app.agent.insights_writer import InsightsWriter
+from app.agent.lease import run_lease
+from app.agent.metrics import agent_metrics, save_snapshot
+from app.agent.work_queue import AgentWorkQueue
+from app.agent.scheduler import AgentScheduler
+from app.agent.registry import (
+    load_dirty_users,
+    start_watermark,
+)
+from app.agent_config import (
+    AGENT_ENGINE,
+    AGENT_WORKERS,
+    AGENT_SHARD_SIZE,
+    AGENT_SWEEP_SECONDS,
+    AGENT_COALESCE_SECONDS,
+    AGENT_POLL_SECONDS,
+    AGENT_HISTORY_DAYS,
+    AGENT_HISTORY_MAX_TXNS,
+    AGENT_HISTORY_PAGE_SIZE,
+    AGENT_CATALOG_SECONDS,
+)
 from app.db_config import FIU_DB
+from app.migrations import migrate
+
+try:
+    from app.agent import engine_numpy
+except ImportError:  # numpy is optional; fall back to the Python engine
+    engine_numpy = None
 
 # ------------------------------------------------------------
 # HELPER: Load all user IDs
@@ -28,79 +64,414 @@ def load_all_users() -> List[str]:
     return users
 
 
+def init_agent_db():
+    """
+    Brings the FIU database schema (agent tables included) up to date.
+    Call once at startup.
+    """
+    migrate()
+
+
 # ------------------------------------------------------------
 # HELPER: Save insights into DB
 # ------------------------------------------------------------
 
 def save_insights(user_id: str, insights: Dict[str, Any]):
+    """
+    One-off write for a single user. Agent runs go through InsightsWriter.
+    """
+    with InsightsWriter() as writer:
+        writer.add(user_id, insights)
+
+
+# ------------------------------------------------------------
+# ANALYTICS ENGINE SELECTION
+# ------------------------------------------------------------
+
+ENGINES = ("python", "numpy")
+
+
+def resolve_engine(engine: Optional[str] = None) -> str:
+    """
+    Returns the engine to use: the requested one, else AGENT_ENGINE.
+    Falls back to "python" when numpy is requested but not installed.
+    """
+    engine = (engine or AGENT_ENGINE).lower()
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown agent engine {engine!r}; expected one of {ENGINES}")
+
+    if engine == "numpy" and engine_numpy is None:
+        print("[AGENT] numpy is not installed, using the python engine.")
+        return "python"
+
+    return engine
+
+
+# ------------------------------------------------------------
+# PER-USER PIPELINE
+# ------------------------------------------------------------
+
+def _run_pipeline(
+    txns: List[Txn],
+    engine: str = "python",
+    user_id: Optional[str] = None,
+    conn: Optional[sqlite3.Connection] = None
+) -> Dict[str, Any]:
+    """
+    Categorize → subscriptions → anomalies → prediction → insights.
+    Each stage is timed into agent_metrics.
+
+    With a user_id, subscriptions come from the persisted per-merchant
+    state (full history, last paid within the history window) instead of
+    a rescan of `txns`, anomalies are the ones scored at ingest within
+    the history window, and merchant totals use the stored canonical
+    merchant mapping. These reads go through `conn` when given (one
+    connection per run instead of several per user).
+
+    engine="numpy" builds columnar arrays once and runs anomalies,
+    prediction and insights on them; results are identical.
+    """
+    # 1. Categorize: only rows ingested under older rules (or never)
+    with agent_metrics.timed("categorize"):
+        txns = categorize_stale(txns)
+
+    # Stored raw -> canonical merchant mapping, looked up once per user
+    merchants = None
+    if user_id:
+        with agent_metrics.timed("merchants"):
+            merchants = load_merchants((t.merchant for t in txns if t.type == "DEBIT"), conn=conn)
+
+    # 2. Detect subscriptions
+    with agent_metrics.timed("subscriptions"):
+        subs = load_subscriptions(user_id, AGENT_HISTORY_DAYS, conn=conn) if user_id else detect_subscriptions(txns)
+
+    if engine == "numpy":
+        return _run_numpy_stages(txns, subs, user_id, merchants, conn)
+
+    # 3. Detect anomalies
+    with agent_metrics.timed("anomalies"):
+        anomalies = load_anomalies(user_id, AGENT_HISTORY_DAYS, conn=conn) if user_id else detect_anomalies(txns)
+
+    # 4. Predict future
+    with agent_metrics.timed("predict"):
+        prediction = predict_future(txns)
+
+    # 5. Generate insights
+    with agent_metrics.timed("insights"):
+        return generate_insights(txns, subs, anomalies, prediction, merchants)
+
+
+def _run_numpy_stages(
+    txns: List[Txn],
+    subs: List[Dict[str, Any]],
+    user_id: Optional[str] = None,
+    merchants: Optional[Dict[Optional[str], Merchant]] = None,
+    conn: Optional[sqlite3.Connection] = None
+) -> Dict[str, Any]:
+    with agent_metrics.timed("columns"):
+        cols = engine_numpy.TxnColumns.from_txns(txns, merchants)
+
+    with agent_metrics.timed("anomalies"):
+        if user_id:
+            anomalies = load_anomalies(user_id, AGENT_HISTORY_DAYS, conn=conn)
+        else:
+            anomalies = engine_numpy.detect_anomalies(txns, cols)
+
+    with agent_metrics.timed("predict"):
+        prediction = engine_numpy.predict_future(txns, cols)
+
+    with agent_metrics.timed("insights"):
+        return engine_numpy.generate_insights(txns, subs, anomalies, prediction, cols)
+
+
+def process_user(user_id: str, engine: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Runs the full pipeline for one user.
+    Returns the insights dict, or None if the user has no transactions.
+    """
+    # 1. Load & categorize transactions
+    with agent_metrics.timed("load"):
+        if AGENT_HISTORY_DAYS:
+            txns = load_history(user_id, AGENT_HISTORY_DAYS, AGENT_HISTORY_MAX_TXNS, rules_version())
+        else:
+            txns = load_transactions(user_id, category_version=rules_version())
+    if not txns:
+        return None
+
+    return _run_pipeline(txns, resolve_engine(engine), user_id)
+
+
+def _iter_user_results(
+    user_ids: List[str],
+    engine: str
+) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Streams (userId, insights) for the given users, loading all of their
+    transactions and stored analytics through one connection. Users
+    without transactions come back with None.
+    """
+    pending = set(user_ids)
     conn = sqlite3.connect(FIU_DB)
-    cur = conn.cursor()
 
-    # Create table if it doesn't exist
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS insights (
-            userId TEXT,
-            generatedAt TEXT,
-            insightsJson TEXT
-        );
-    """)
-
-    cur.execute("""
-        INSERT INTO insights (userId, generatedAt, insightsJson)
-        VALUES (?, ?, ?)
-    """, (
-        user_id,
-        insights["generated_at"],
-        str(insights)   # stored as string (simple storage)
-    ))
-
-    conn.commit()
-    conn.close()
+    try:
+        # 1. Bulk-load transactions for all users
+        if AGENT_HISTORY_DAYS:
+            groups = iter_user_histories(
+                user_ids, AGENT_HISTORY_DAYS, AGENT_HISTORY_MAX_TXNS, AGENT_HISTORY_PAGE_SIZE,
+                category_version=rules_version(), conn=conn)
+        else:
+            groups = iter_user_transactions(user_ids, category_version=rules_version(), conn=conn)
+        while True:
+            with agent_metrics.timed("load"):
+                group = next(groups, None)
+            if group is None:
+                break
+
+            user_id, txns = group
+            pending.discard(user_id)
+            yield user_id, _run_pipeline(txns, engine, user_id, conn)
+    finally:
+        conn.close()
+
+    for user_id in pending:
+        yield user_id, None
+
+
+def _process_shard(user_ids: List[str], engine: str):
+    """
+    Worker-process entry point: runs the pipeline for a shard of users.
+    Returns (results, exported stage metrics) so the parent can merge
+    the worker's timings into its own.
+    """
+    # Workers may inherit the parent's metrics or be reused; start clean
+    agent_metrics.reset()
+    results = list(_iter_user_results(user_ids, engine))
+    return results, agent_metrics.export()
+
+
+def _shards(users: List[str], size: int) -> List[List[str]]:
+    return [users[i:i + size] for i in range(0, len(users), size)]
+
+
+def _iter_shard_results(
+    users: List[str],
+    workers: int,
+    engine: str
+) -> Iterator[List[Tuple[str, Optional[Dict[str, Any]]]]]:
+    """
+    Yields per-shard results, computed in-process (workers <= 1)
+    or across a pool of worker processes.
+    """
+    shard_size = max(1, AGENT_SHARD_SIZE)
+
+    if workers <= 1 or len(users) <= shard_size:
+        # Serial mode: one loader connection for the whole run,
+        # results handed to the writer a shard at a time
+        batch = []
+        for result in _iter_user_results(users, engine):
+            batch.append(result)
+            if len(batch) >= shard_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    shards = _shards(users, shard_size)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+        futures = [pool.submit(_process_shard, shard, engine) for shard in shards]
+        for future in as_completed(futures):
+            results, timings = future.result()
+            agent_metrics.merge(timings)
+            yield results
 
 
 # ------------------------------------------------------------
 # MAIN AGENT LOOP (single run)
 # ------------------------------------------------------------
 
-def run_agent_once():
+def run_agent_once(
+    full: bool = False,
+    workers: Optional[int] = None,
+    user_ids: Optional[List[str]] = None,
+    engine: Optional[str] = None,
+    only_dirty: bool = False
+) -> Dict[str, Any]:
+    """
+    Recomputes insights for users whose data changed since their last run.
+    Pass full=True to sweep every user regardless of watermarks, or
+    user_ids to process exactly those users (e.g. just-synced ones).
+    With only_dirty=True, user_ids already processed by another run are
+    dropped once the lease is held.
+
+    With workers > 1 users are sharded across a process pool; the parent
+    process stays the single writer for insights and watermarks.
+
+    engine picks the analytics engine ("python" / "numpy"); defaults to
+    AGENT_ENGINE.
+
+    Only one run is active at a time across all processes: the run is
+    skipped when another process holds the agent lease.
+
+    Returns run stats: users processed, elapsed seconds and users/sec.
+    """
+    workers = AGENT_WORKERS if workers is None else workers
+    engine = resolve_engine(engine)
+
+    def select_users() -> List[str]:
+        if user_ids is not None and only_dirty:
+            dirty = set(load_dirty_users())
+            return [u for u in user_ids if u in dirty]
+        if user_ids is not None:
+            return list(user_ids)
+        return load_all_users() if full else load_dirty_users()
+
+    idle = {"users": 0, "seconds": 0.0, "users_per_sec": 0.0}
+
+    # Cheap read first, so idle polls never take the write lock
+    if not select_users():
+        return idle
+
+    if not run_lease.acquire():
+        print("[AGENT] Another agent run holds the lease. Skipping.")
+        return dict(idle, skipped=True)
+
+    try:
+        # Re-read under the lease: another holder may have just finished
+        watermark = start_watermark()
+        users = select_users()
+        if not users:
+            return idle
+
+        return _run_locked(users, workers, engine, watermark)
+    finally:
+        run_lease.release()
+
+
+def _run_locked(users: List[str], workers: int, engine: str, watermark: str) -> Dict[str, Any]:
     print("\n[AGENT] Starting agent run...")
+    print(f"[AGENT] Found {len(users)} users to process "
+          f"({workers} worker(s), {engine} engine).")
 
-    users = load_all_users()
-    if not users:
-        print("[AGENT] No users found. Nothing to do.")
-        return
+    started = time.perf_counter()
 
-    print(f"[AGENT] Found {len(users)} users.")
+    # Backdated debits: rebuild subscription state here, in the single
+    # writer, so workers only read it
+    rebuilt = rebuild_flagged_states(users)
+    if rebuilt:
+        print(f"[AGENT] Rebuilt subscription state for {rebuilt} users.")
 
-    for user_id in users:
-        print(f"\n[AGENT] Processing user: {user_id}")
+    # 6. Save insights (single writer, batched transactions)
+    with InsightsWriter(watermark) as writer:
+        for results in _iter_shard_results(users, workers, engine):
+            for user_id, insights in results:
+                if insights is None:
+                    print(f"[AGENT] No transactions for user {user_id}.")
+                writer.add(user_id, insights)
 
-        # 1. Load & categorize transactions
-        txns = load_transactions(user_id)
-        if not txns:
-            print("[AGENT] No transactions for this user.")
-            continue
+            if not run_lease.renew():
+                raise RuntimeError("Agent lease lost mid-run; stopping.")
 
-        txns = categorize_batch(txns)
+    print(f"[AGENT] Saved {writer.written} insights ({writer.unchanged} unchanged) "
+          f"in {writer.flushes} batch(es).")
 
-        # 2. Detect subscriptions
-        subs = detect_subscriptions(txns)
+    elapsed = time.perf_counter() - started
+    throughput = len(users) / elapsed if elapsed > 0 else 0.0
 
-        # 3. Detect anomalies
-        anomalies = detect_anomalies(txns)
+    print(f"\n[AGENT] Agent run completed: {len(users)} users in {elapsed:.2f}s "
+          f"({throughput:.1f} users/sec).")
+
+    stats = {
+        "users": len(users),
+        "seconds": round(elapsed, 4),
+        "users_per_sec": round(throughput, 2),
+        # This process only; with AGENT_WORKERS > 1 each worker has its own
+        "categorizer_cache": cache_stats(),
+    }
+
+    agent_metrics.record("run", elapsed)
+    agent_metrics.last_run = stats
+
+    return stats
 
-        # 4. Predict future
-        prediction = predict_future(txns)
 
-        # 5. Generate insights
-        insights = generate_insights(txns, subs, anomalies, prediction)
+# ------------------------------------------------------------
+# EVENT-DRIVEN MODE (sync-triggered runs + periodic sweep)
+# ------------------------------------------------------------
+
+def _maybe_rebuild_catalog():
+    """Rebuilds the shared subscription catalog once it is due."""
+    if AGENT_CATALOG_SECONDS:
+        build_catalog(max_age=AGENT_CATALOG_SECONDS)
+
+
+def run_agent_worker(
+    queue: Optional[AgentWorkQueue] = None,
+    sweep_interval: float = AGENT_SWEEP_SECONDS,
+    coalesce_seconds: float = AGENT_COALESCE_SECONDS,
+    poll_seconds: float = AGENT_POLL_SECONDS
+):
+    """
+    Runs forever.
 
-        # 6. Save insights per user
-        save_insights(user_id, insights)
+    With a queue (agent embedded in the API process), users enqueued by
+    syncs are processed as soon as they arrive (bursts coalesced into
+    one run); when the queue stays quiet for `sweep_interval` seconds, a
+    sweep over all dirty users runs as a safety net.
+
+    Without a queue (standalone worker), the users registry is the
+    signal: each scheduler cycle processes the most urgent dirty users
+    that fit its time budget, then sleeps between `poll_seconds` (while
+    there is a backlog) and AGENT_POLL_MAX_SECONDS (while idle).
+
+    Either way the shared subscription catalog is rebuilt every
+    AGENT_CATALOG_SECONDS.
+    """
+    if queue is None:
+        scheduler = AgentScheduler(min_interval=poll_seconds)
+        print(f"[AGENT] Scheduler mode ({scheduler.budget_seconds:g}s budget per cycle).")
+
+        while True:
+            processed = 0
+            try:
+                users = scheduler.next_users()
+                if users:
+                    stats = run_agent_once(user_ids=users, only_dirty=True)
+                    scheduler.record(stats)
+                    processed = stats["users"]
+
+                    if processed:
+                        save_snapshot()
+                    if scheduler.backlog:
+                        print(f"[AGENT] {scheduler.backlog} users left for the next cycle.")
+
+                _maybe_rebuild_catalog()
+            except Exception as e:
+                print("[AGENT] ERROR:", e)
+
+            time.sleep(scheduler.next_interval(processed))
+
+    print(f"[AGENT] Event-driven mode (sweep every {sweep_interval:.0f}s).")
+
+    next_sweep = time.monotonic()
+
+    while True:
+        timeout = max(0.0, next_sweep - time.monotonic())
+        users = queue.wait(timeout, coalesce_seconds)
 
-        print(f"[AGENT] Insights generated and saved for user {user_id}")
+        try:
+            if users:
+                run_agent_once(user_ids=sorted(users))
 
-    print("\n[AGENT] Agent run completed.")
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + sweep_interval
+                run_agent_once()
+                _maybe_rebuild_catalog()
+        except Exception as e:
+            # Users stay dirty, so the next sweep retries them
+            print("[AGENT] ERROR:", e)
 
 
 # ------------------------------------------------------------
@@ -120,4 +491,5 @@ def run_agent_forever(interval_seconds: int = 60):
 
 if __name__ == "__main__":
     # Run once if script is executed directly
+    init_agent_db()
     run_agent_once()
@@ -1,6 +1,17 @@
-from typing import List, Dict, Any
+import math
+import sqlite3
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from statistics import mean, stdev
 
+from app.agent.loader import Txn, _parse_iso, history_start
+from app.db_config import FIU_DB
+
+# Debits above the category mean by more than this many standard
+# deviations are anomalies
+ANOMALY_SIGMAS = 2.5
+
+
 # ------------------------------------------------------------
 # HELPER: Safe standard deviation
 # ------------------------------------------------------------
@@ -16,7 +27,7 @@ def _std(values: List[float]) -> float:
 # HELPER: Detect category-level spending baseline
 # ------------------------------------------------------------
 
-def _compute_baselines(txns: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+def _compute_baselines(txns: List[Txn]) -> Dict[str, Dict[str, float]]:
     """
     Builds a baseline for each category:
     {
@@ -28,11 +39,11 @@ def _compute_baselines(txns: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]
     buckets = {}
 
     for t in txns:
-        if t["type"] != "DEBIT":
+        if t.type != "DEBIT":
             continue
 
-        cat = t["category"]
-        buckets.setdefault(cat, []).append(t["amount"])
+        cat = t.category
+        buckets.setdefault(cat, []).append(t.amount)
 
     baselines = {}
     for cat, amounts in buckets.items():
@@ -48,7 +59,7 @@ def _compute_baselines(txns: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]
 # MAIN ANOMALY DETECTION
 # ------------------------------------------------------------
 
-def detect_anomalies(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def detect_anomalies(txns: List[Txn]) -> List[Dict[str, Any]]:
     """
     Detects transactions whose amount is unusually high
     compared to the user's typical category baseline.
@@ -71,11 +82,11 @@ def detect_anomalies(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     baselines = _compute_baselines(txns)
 
     for t in txns:
-        if t["type"] != "DEBIT":
+        if t.type != "DEBIT":
             continue
 
-        cat = t["category"]
-        amount = t["amount"]
+        cat = t.category
+        amount = t.amount
 
         if cat not in baselines:
             continue
@@ -88,14 +99,270 @@ def detect_anomalies(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             continue
 
         # Step 2 — anomaly rule: beyond 2.5 standard deviations
-        if amount > avg + 2.5 * std:
+        if amount > avg + ANOMALY_SIGMAS * std:
             anomalies.append({
                 "amount": amount,
                 "category": cat,
-                "merchant": t["merchant"],
-                "narration": t["narration"],
-                "date": t["date"].isoformat(),
+                "merchant": t.merchant,
+                "narration": t.narration,
+                "date": t.date.isoformat(),
                 "reason": f"Unusually high compared to your typical {cat} spending."
             })
 
     return anomalies
+
+
+# ------------------------------------------------------------
+# STREAMING SCORING AT INGEST (persisted Welford statistics)
+# ------------------------------------------------------------
+#
+# category_stats keeps a running count / mean / M2 (Welford) of debit
+# amounts per (user, category). save_fi_data folds each new debit in and
+# scores it against the updated baseline with the same 2.5σ rule as
+# detect_anomalies, in O(1), and anomalies are stored as they are found.
+# The agent reads them back instead of recomputing baselines per run.
+#
+# Welford totals don't depend on arrival order, so backdated debits need
+# no special handling. When stored categories change (recategorize),
+# the user's stats are flagged and rebuilt from the transactions table
+# at the next ingest; anomalies already found are kept.
+
+# (count, mean, M2)
+Stats = List[float]
+
+# Amount, category, merchant, narration, valueDate, valueTs, txnId
+Debit = Tuple[float, str, Optional[str], Optional[str], str, int, str]
+
+
+def _welford(stats: Stats, amount: float):
+    count, avg, m2 = stats
+    count += 1
+    delta = amount - avg
+    avg += delta / count
+    stats[0], stats[1], stats[2] = count, avg, m2 + delta * (amount - avg)
+
+
+def _baseline_std(stats: Stats) -> float:
+    """Sample standard deviation, 0 below two debits (as _std)."""
+    count, _, m2 = stats
+    if count < 2:
+        return 0
+    return math.sqrt(max(m2, 0.0) / (count - 1))
+
+
+def _score(stats: Stats, amount: float) -> Optional[Tuple[float, float]]:
+    """(mean, std) of the baseline if `amount` is anomalous against it."""
+    std = _baseline_std(stats)
+    if std == 0:
+        return None
+    if amount > stats[1] + ANOMALY_SIGMAS * std:
+        return stats[1], std
+    return None
+
+
+def _debit_rows(cur: sqlite3.Cursor, user_id: Optional[str] = None) -> Iterable[tuple]:
+    """
+    Stored debits, per user in valueTs order, in Debit layout plus userId.
+    Rows without a valueTs (unparseable valueDate) are skipped. Streams
+    through its own cursor, so the caller can write meanwhile.
+    """
+    where = "WHERE txnType = 'DEBIT' AND valueTs IS NOT NULL" + (" AND userId = ?" if user_id else "")
+    return cur.connection.execute(f"""
+        SELECT amount, COALESCE(NULLIF(category, ''), 'Uncategorized'),
+               merchant, narration, valueDate, valueTs, txnId, userId
+        FROM transactions
+        {where}
+        ORDER BY userId, valueTs, txnId
+    """, (user_id,) if user_id else ())
+
+
+def _save_stats(cur: sqlite3.Cursor, user_id: str, stats: Dict[str, Stats]):
+    cur.executemany("""
+        INSERT INTO category_stats (userId, category, count, mean, m2, needsRebuild)
+        VALUES (?, ?, ?, ?, ?, 0)
+        ON CONFLICT(userId, category) DO UPDATE SET
+            count = excluded.count,
+            mean = excluded.mean,
+            m2 = excluded.m2,
+            needsRebuild = 0;
+    """, [(user_id, category, *values) for category, values in stats.items()])
+
+
+def _save_anomalies(cur: sqlite3.Cursor, user_id: str, found: List[Tuple[Debit, float, float]]):
+    detected_at = datetime.utcnow().isoformat() + "Z"
+    cur.executemany("""
+        INSERT OR IGNORE INTO anomalies
+            (txnId, userId, amount, category, merchant, narration,
+             valueDate, valueTs, baselineMean, baselineStd, detectedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (debit[6], user_id, *debit[:6], avg, std, detected_at)
+        for debit, avg, std in found
+    ])
+
+
+def _anomaly_record(amount, category, merchant, narration, value_date) -> Dict[str, Any]:
+    """Same shape as detect_anomalies' entries."""
+    return {
+        "amount": amount,
+        "category": category,
+        "merchant": merchant,
+        "narration": narration,
+        "date": _parse_iso(value_date).isoformat(),
+        "reason": f"Unusually high compared to your typical {category} spending."
+    }
+
+
+def rebuild_category_stats(cur: sqlite3.Cursor, user_id: str):
+    """Recomputes a user's category stats from stored debits."""
+    stats: Dict[str, Stats] = {}
+    for row in _debit_rows(cur, user_id):
+        _welford(stats.setdefault(row[1], [0, 0.0, 0.0]), row[0])
+
+    cur.execute("DELETE FROM category_stats WHERE userId = ?", (user_id,))
+    _save_stats(cur, user_id, stats)
+
+
+def replay_all_debits(cur: sqlite3.Cursor):
+    """
+    Seeds stats and anomalies from the stored history, scoring every
+    debit in date order as if it had streamed in.
+    """
+    user_id, stats, found = None, {}, []
+
+    def flush():
+        if user_id is not None:
+            _save_stats(cur, user_id, stats)
+            _save_anomalies(cur, user_id, found)
+
+    for row in _debit_rows(cur):
+        if row[7] != user_id:
+            flush()
+            user_id, stats, found = row[7], {}, []
+
+        category_stats = stats.setdefault(row[1], [0, 0.0, 0.0])
+        _welford(category_stats, row[0])
+
+        hit = _score(category_stats, row[0])
+        if hit:
+            found.append((row[:7], *hit))
+
+    flush()
+
+
+def invalidate_category_stats(cur: sqlite3.Cursor, user_id: str):
+    """Flags a user's stats for a rebuild after their categories changed."""
+    cur.execute("UPDATE category_stats SET needsRebuild = 1 WHERE userId = ?", (user_id,))
+
+
+def score_debits(cur: sqlite3.Cursor, user_id: str, debits: List[Debit]) -> List[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Folds newly stored debits into the user's category stats (in the
+    caller's transaction), stores the anomalous ones and returns them
+    as (anomalies rowid, valueTs, record) triples. Debits without a
+    valueTs are skipped, like everywhere else in the agent.
+    """
+    debits = [debit for debit in debits if debit[5] is not None]
+    if not debits:
+        return []
+
+    stale = cur.execute(
+        "SELECT 1 FROM category_stats WHERE userId = ? AND needsRebuild = 1 LIMIT 1",
+        (user_id,),
+    ).fetchone()
+
+    if stale:
+        # The rebuilt baseline already contains the new debits
+        rebuild_category_stats(cur, user_id)
+
+    categories = sorted({debit[1] for debit in debits})
+    placeholders = ",".join("?" for _ in categories)
+    stats = {
+        row[0]: list(row[1:])
+        for row in cur.execute(f"""
+            SELECT category, count, mean, m2 FROM category_stats
+            WHERE userId = ? AND category IN ({placeholders})
+        """, (user_id, *categories))
+    }
+
+    found = []
+    for debit in sorted(debits, key=lambda d: (d[5], d[6])):
+        category_stats = stats.setdefault(debit[1], [0, 0.0, 0.0])
+        if not stale:
+            _welford(category_stats, debit[0])
+
+        hit = _score(category_stats, debit[0])
+        if hit:
+            found.append((debit, *hit))
+
+    if not stale:
+        _save_stats(cur, user_id, stats)
+    _save_anomalies(cur, user_id, found)
+
+    if not found:
+        return []
+
+    txn_ids = [debit[6] for debit, _, _ in found]
+    placeholders = ",".join("?" for _ in txn_ids)
+    row_ids = dict(cur.execute(
+        f"SELECT txnId, rowid FROM anomalies WHERE txnId IN ({placeholders})", txn_ids,
+    ).fetchall())
+
+    return [(row_ids[debit[6]], debit[5], _anomaly_record(*debit[:5])) for debit, _, _ in found]
+
+
+def load_anomalies(
+    user_id: str,
+    days: Optional[float] = None,
+    db_path: str = FIU_DB,
+    conn: Optional[sqlite3.Connection] = None
+) -> List[Dict[str, Any]]:
+    """
+    Anomalies stored for a user within the same window as their loaded
+    history (see history_start), newest first. Reads through `conn`
+    when given.
+    """
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT amount, category, merchant, narration, valueDate
+            FROM anomalies
+            WHERE userId = ? AND valueTs >= ?
+            ORDER BY valueTs DESC, txnId DESC
+        """, (user_id, history_start(conn, user_id, days))).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    return [_anomaly_record(*row) for row in rows]
+
+
+def load_anomalies_since(
+    user_id: str,
+    after_id: int,
+    limit: int,
+    db_path: str = FIU_DB
+) -> Tuple[List[Tuple[int, Dict[str, Any]]], int]:
+    """
+    Anomalies stored for a user after rowid `after_id`, as (rowid,
+    record) pairs in storage order: the newest `limit` of them, plus how
+    many older ones were left out.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        total = conn.execute(
+            "SELECT COUNT(*) FROM anomalies WHERE userId = ? AND rowid > ? AND valueTs IS NOT NULL",
+            (user_id, after_id),
+        ).fetchone()[0]
+        rows = conn.execute("""
+            SELECT rowid, amount, category, merchant, narration, valueDate
+            FROM anomalies
+            WHERE userId = ? AND rowid > ? AND valueTs IS NOT NULL
+            ORDER BY rowid DESC
+            LIMIT ?
+        """, (user_id, after_id, limit)).fetchall()
+    finally:
+        conn.close()
+
+    return [(row[0], _anomaly_record(*row[1:])) for row in reversed(rows)], total - len(rows)
@@ -0,0 +1,209 @@
+import argparse
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+from app.agent.cycles import cycle_from_gaps
+from app.agent_config import AGENT_CATALOG_SECONDS
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# SHARED SUBSCRIPTION CATALOG
+# ------------------------------------------------------------
+#
+# What every user's subscription detection would otherwise rediscover on
+# its own: NETFLIX bills monthly at ~₹649, SWIGGY is not a subscription.
+# build_catalog() aggregates the persisted per-user merchant state of all
+# users into one row per canonical merchant:
+#
+#   recurring = 1  most repeat customers have a detected subscription;
+#                  typical cycle, price band and user count are kept
+#   recurring = 0  many repeat customers, hardly any subscriptions
+#
+# Merchants without enough users to tell are left out. Subscription
+# detection uses the catalog as a fast path: recurring merchants are
+# accepted after a single payment within the price band (other amounts
+# go through the usual cycle inference), non-recurring ones are skipped.
+#
+# The agent worker rebuilds the catalog every AGENT_CATALOG_SECONDS; it
+# can also be rebuilt by hand:
+#
+#   cd backend
+#   python -m app.agent.catalog
+
+# Repeat customers needed before a merchant is catalogued either way
+CATALOG_MIN_USERS = 3
+
+# Share of repeat customers with a detected subscription above which a
+# merchant is recurring, and below which it is non-recurring
+RECURRING_SHARE = 0.6
+NON_RECURRING_SHARE = 0.05
+
+# Price bands are widened by this much either side when matching
+BAND_TOLERANCE = 0.20
+
+# How long a process reuses the catalog it loaded (seconds)
+CATALOG_TTL_SECONDS = 60
+
+# merchant -> (recurring, cycle, low amount, high amount)
+Entry = Tuple[bool, Optional[str], Optional[float], Optional[float]]
+
+
+# ------------------------------------------------------------
+# LOOKUP
+# ------------------------------------------------------------
+
+_catalog: Dict[str, Entry] = {}
+_loaded_at = None
+
+
+def load_catalog(db_path: str = FIU_DB) -> Dict[str, Entry]:
+    """The catalog, re-read at most every CATALOG_TTL_SECONDS."""
+    global _catalog, _loaded_at
+
+    now = time.monotonic()
+    if _loaded_at is not None and now - _loaded_at < CATALOG_TTL_SECONDS:
+        return _catalog
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # Absent until migration 7 (e.g. in-memory benchmarks)
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subscription_catalog'"
+        ).fetchone()
+        rows = conn.execute("""
+            SELECT merchant, recurring, cycle, lowAmount, highAmount
+            FROM subscription_catalog
+        """).fetchall() if exists else []
+    finally:
+        conn.close()
+
+    _catalog = {row[0]: (bool(row[1]), row[2], row[3], row[4]) for row in rows}
+    _loaded_at = now
+    return _catalog
+
+
+def in_band(entry: Entry, amount: float) -> bool:
+    """Whether an average payment fits a recurring entry's price band."""
+    _, _, low, high = entry
+    return low * (1 - BAND_TOLERANCE) <= amount <= high * (1 + BAND_TOLERANCE)
+
+
+# ------------------------------------------------------------
+# BATCH BUILD
+# ------------------------------------------------------------
+
+def _aggregate(rows) -> List[Tuple[str, int, Optional[str], Optional[float], Optional[float], int]]:
+    """Catalog rows from (merchant, count, amountSum, gapDaysSum, similar) states."""
+    repeat_users = Counter()
+    # merchant -> cycle -> per-user average amounts
+    subscribed: Dict[str, Dict[str, List[float]]] = {}
+
+    for merchant, count, amount_sum, gap_days, similar in rows:
+        repeat_users[merchant] += 1
+
+        cycle = cycle_from_gaps(gap_days, count - 1) if similar else "Unknown"
+        if cycle != "Unknown":
+            amount = float(Fraction(amount_sum) / count)
+            subscribed.setdefault(merchant, {}).setdefault(cycle, []).append(amount)
+
+    entries = []
+    for merchant, users in repeat_users.items():
+        if users < CATALOG_MIN_USERS:
+            continue
+
+        cycles = subscribed.get(merchant, {})
+        subscribers = sum(len(amounts) for amounts in cycles.values())
+        share = subscribers / users
+
+        if subscribers >= CATALOG_MIN_USERS and share >= RECURRING_SHARE:
+            cycle, amounts = max(cycles.items(), key=lambda item: len(item[1]))
+            entries.append((merchant, 1, cycle, min(amounts), max(amounts), subscribers))
+        elif share <= NON_RECURRING_SHARE:
+            entries.append((merchant, 0, None, None, None, users))
+
+    return entries
+
+
+def _built_at(cur: sqlite3.Cursor) -> Optional[float]:
+    row = cur.execute("SELECT builtAt FROM subscription_catalog_build WHERE id = 1").fetchone()
+    return row[0] if row else None
+
+
+def build_catalog(max_age: Optional[float] = None, db_path: str = FIU_DB) -> Optional[int]:
+    """
+    Rebuilds the catalog from every user's subscription state and
+    returns the number of catalogued merchants. With `max_age`, does
+    nothing (and returns None) unless the current catalog is older.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None  # explicit transaction below
+    cur = conn.cursor()
+
+    try:
+        def due() -> bool:
+            built = _built_at(cur)
+            return max_age is None or built is None or time.time() - built >= max_age
+
+        if not due():
+            return None
+
+        # Scan outside the write transaction; only the swap blocks ingest
+        entries = _aggregate(cur.execute("""
+            SELECT merchant, count, amountSum, gapDaysSum, similar
+            FROM subscription_state
+            WHERE count >= 2
+        """).fetchall())
+
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have rebuilt it meanwhile
+            if not due():
+                cur.execute("ROLLBACK")
+                return None
+
+            cur.execute("DELETE FROM subscription_catalog")
+            cur.executemany("""
+                INSERT INTO subscription_catalog
+                    (merchant, recurring, cycle, lowAmount, highAmount, userCount)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, entries)
+            cur.execute("""
+                INSERT INTO subscription_catalog_build (id, builtAt, merchants)
+                VALUES (1, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    builtAt = excluded.builtAt,
+                    merchants = excluded.merchants;
+            """, (time.time(), len(entries)))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    recurring = sum(1 for entry in entries if entry[1])
+    print(f"[CATALOG] Rebuilt at {datetime.utcnow().isoformat()}Z: {recurring} recurring, "
+          f"{len(entries) - recurring} non-recurring merchants.")
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the shared subscription catalog.")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help=f"only rebuild if older than this many seconds "
+                             f"(the worker uses {AGENT_CATALOG_SECONDS:g})")
+    args = parser.parse_args(argv)
+
+    from app.migrations import migrate
+    migrate()
+
+    if build_catalog(args.max_age) is None:
+        print("[CATALOG] Catalog is recent enough; nothing to do.")
+
+
+if __name__ == "__main__":
+    main()
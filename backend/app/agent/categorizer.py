@@ -1,4 +1,11 @@
-from typing import Dict, Any
+import hashlib
+import json
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Pattern, Tuple
+
+from app.agent.loader import Txn
+from app.agent_config import CATEGORY_CACHE_SIZE
 
 # ------------------------------------------------------------
 # CATEGORY KEYWORDS (India-focused)
@@ -73,28 +80,134 @@ def _clean(s: str) -> str:
     return (s or "").upper()
 
 
+# ------------------------------------------------------------
+# COMPILED KEYWORD MATCHER
+# ------------------------------------------------------------
+#
+# Rule: the first category (in CATEGORY_KEYWORDS order) with any keyword
+# occurring as a substring of the blob wins.
+#
+# All keywords are compiled into one regex shaped like a trie (shared
+# prefixes factored out, longer keywords preferred), so a single scan
+# finds every position where some keyword starts. The keywords that
+# start at one position are all prefixes of the longest one, so each
+# keyword maps to the best priority among its keyword prefixes; the
+# lowest priority seen anywhere in the blob is the winning category.
+# Keywords are matched case-sensitively against the upper-cased blob,
+# exactly like the `kw in blob` loop this replaces.
+
+def _trie_regex(keywords: List[str]) -> str:
+    trie = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end of keyword
+
+    def emit(node) -> str:
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A keyword ends here: the longer continuation is optional (greedy)
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+def compile_rules(rules: Dict[str, List[str]]) -> Tuple[Pattern, Dict[str, int], List[str]]:
+    """
+    Builds the matcher for a rules dict: (pattern, keyword -> priority,
+    categories by priority).
+    """
+    categories = list(rules)
+
+    priority = {}
+    for rank, keywords in enumerate(rules.values()):
+        for kw in keywords:
+            priority.setdefault(kw, rank)
+
+    keywords = [kw for kw in priority if kw]
+    best = {
+        kw: min(priority[other] for other in keywords if kw.startswith(other))
+        for kw in keywords
+    }
+
+    # (?!) never matches: no keywords means no category
+    pattern = re.compile(_trie_regex(keywords) or "(?!)")
+    return pattern, best, categories
+
+
+# Compiled by refresh_rules() below
+_pattern, _best, _categories = None, {}, []
+_rules_version = None
+
+# Bumped by update_rules(), so single categorize_* calls notice it
+_rules_revision = 0
+_compiled_revision = None
+
+
+def match_category(blob: str) -> Optional[str]:
+    """
+    First category whose keywords occur in the (upper-cased) blob,
+    or None.
+    """
+    search = _pattern.search
+    found = None
+    pos = 0
+
+    while True:
+        m = search(blob, pos)
+        if m is None:
+            break
+
+        rank = _best[m.group()]
+        if found is None or rank < found:
+            found = rank
+            if rank == 0:
+                break
+
+        # Keywords may overlap; resume right after this start position
+        pos = m.start() + 1
+
+    return None if found is None else _categories[found]
+
+
 # ------------------------------------------------------------
 # MAIN CATEGORY DETECTION
 # ------------------------------------------------------------
 
-def categorize_transaction(txn: Dict[str, Any]) -> str:
+def categorize_transaction(txn: Txn) -> str:
     """
     Categorizes a single transaction based on merchant and narration.
     Returns a category string.
+
+    Results are memoized per (merchant, narration, type) after upper-
+    casing, which is all the rules look at.
     """
-    merchant = _clean(txn.get("merchant", ""))
-    narration = _clean(txn.get("narration", ""))
+    if _compiled_revision != _rules_revision:
+        refresh_rules()
+    return _categorize_key(_clean(txn.merchant), _clean(txn.narration), txn.type)
 
+
+def categorize_fields(merchant: str, narration: str, txn_type: str) -> str:
+    """categorize_transaction for raw AA fields (used at ingest)."""
+    if _compiled_revision != _rules_revision:
+        refresh_rules()
+    return _categorize_key(_clean(merchant), _clean(narration), txn_type)
+
+
+@lru_cache(maxsize=CATEGORY_CACHE_SIZE)
+def _categorize_key(merchant: str, narration: str, txn_type: str) -> str:
     # Merge both fields into a searchable blob
     blob = f"{merchant} {narration}"
 
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        for kw in keywords:
-            if kw in blob:
-                return category
+    category = match_category(blob)
+    if category is not None:
+        return category
 
     # Special rules
-    if txn["type"] == "CREDIT":
+    if txn_type == "CREDIT":
         # Salary inference
         if "SALARY" in blob or "PAYROLL" in blob:
             return "Salary"
@@ -105,15 +218,96 @@ def categorize_transaction(txn: Dict[str, Any]) -> str:
     return DEFAULT_CATEGORY
 
 
+# ------------------------------------------------------------
+# RULES VERSION + CACHE INVALIDATION
+# ------------------------------------------------------------
+
+def rules_fingerprint(rules: Optional[Dict[str, List[str]]] = None) -> str:
+    """Short stable hash of a rules dict (same value in every process)."""
+    blob = json.dumps(list((rules or CATEGORY_KEYWORDS).items()), ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+
+def refresh_rules() -> str:
+    """
+    Recompiles the matcher and empties the cache if the rules changed
+    since the last compile. Returns the current rules version.
+
+    Rehashes CATEGORY_KEYWORDS on every call (tens of microseconds), so
+    in-place edits are picked up too. Called once per batch, ingest call
+    and agent run rather than per transaction.
+    """
+    global _pattern, _best, _categories, _rules_version, _compiled_revision
+
+    version = rules_fingerprint()
+    if version != _rules_version:
+        _pattern, _best, _categories = compile_rules(CATEGORY_KEYWORDS)
+        _categorize_key.cache_clear()
+        _rules_version = version
+
+    _compiled_revision = _rules_revision
+    return version
+
+
+def update_rules(rules: Dict[str, List[str]]) -> str:
+    """
+    Replaces CATEGORY_KEYWORDS and makes every categorize_* call use the
+    new rules right away. Returns the new rules version.
+    """
+    global _rules_revision
+
+    CATEGORY_KEYWORDS.clear()
+    CATEGORY_KEYWORDS.update(rules)
+    _rules_revision += 1
+    return refresh_rules()
+
+
+def rules_version() -> str:
+    """Version of the categorization rules currently in effect."""
+    return refresh_rules()
+
+
+def cache_stats() -> Dict[str, Any]:
+    info = _categorize_key.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0,
+        "rules_version": _rules_version,
+    }
+
+
+refresh_rules()
+
+
 # ------------------------------------------------------------
 # BATCH CATEGORIZATION
 # ------------------------------------------------------------
 
-def categorize_batch(txns: list) -> list:
+def categorize_batch(txns: List[Txn]) -> List[Txn]:
     """
     Categorizes a list of transactions in place.
     Returns the same list with updated category labels.
     """
+    refresh_rules()
+
+    for t in txns:
+        t.category = categorize_transaction(t)
+    return txns
+
+
+def categorize_stale(txns: List[Txn]) -> List[Txn]:
+    """
+    Categorizes, in place, only transactions without a trusted stored
+    category (loaded as None: never categorized, or categorized under
+    older rules). Returns the same list.
+    """
+    refresh_rules()
+
     for t in txns:
-        t["category"] = categorize_transaction(t)
+        if t.category is None:
+            t.category = categorize_transaction(t)
     return txns
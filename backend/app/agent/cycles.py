@@ -0,0 +1,30 @@
+# ------------------------------------------------------------
+# BILLING CYCLES
+# ------------------------------------------------------------
+#
+# Shared by subscription detection (per user) and the subscription
+# catalog (across users), so both classify payment gaps the same way.
+
+# (cycle, min avg gap, max avg gap) in days
+CYCLES = [
+    ("Monthly", 26, 34),
+    ("Quarterly", 85, 95),
+    ("Yearly", 350, 380),
+]
+
+NEXT_PAYMENT_DAYS = {"Monthly": 30, "Quarterly": 90, "Yearly": 365}
+
+
+def cycle_from_gaps(gap_days_sum: int, gap_count: int) -> str:
+    """
+    Cycle for an average gap of gap_days_sum / gap_count days, compared
+    exactly in integers so running totals give the same answer.
+    """
+    if gap_count < 1:
+        return "Unknown"
+
+    for cycle, low, high in CYCLES:
+        if low * gap_count <= gap_days_sum <= high * gap_count:
+            return cycle
+
+    return "Unknown"
@@ -0,0 +1,419 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import statistics
+
+import numpy as np
+
+from app.agent.anomalies import _std
+from app.agent.predictor import _predict_next_value
+from app.agent.insights import generate_recommendations
+from app.agent.loader import Txn
+from app.agent.merchants import Merchant, merchant_names
+
+# ------------------------------------------------------------
+# NUMPY ANALYTICS ENGINE
+# ------------------------------------------------------------
+#
+# Drop-in replacements for detect_anomalies, predict_future and
+# generate_insights that work on columnar arrays built once per user.
+#
+# Output is identical to the pure-Python functions:
+#   - sums use np.add.at / cumsum, which accumulate sequentially in
+#     transaction order exactly like the Python loops (no pairwise sum)
+#   - per-category mean/stdev still go through `statistics`
+#   - "first key wins" ties follow the same first-appearance order
+#     as the dicts built by the Python code
+
+_DAY_US = 86_400_000_000
+_HOUR_US = 3_600_000_000
+
+
+class TxnColumns:
+    """
+    Columnar view of one user's transactions (same order as the list).
+    Build with TxnColumns.from_txns() or columns_for_batch().
+    """
+
+    def __init__(self, txns, amount, is_debit, is_credit, date_us, cat_codes,
+                 merchant_codes, categories, merchants):
+        self.txns = txns
+        self.amount = amount                  # float64
+        self.is_debit = is_debit              # bool
+        self.is_credit = is_credit            # bool
+        self.date_us = date_us                # int64 µs since epoch
+        self.cat_codes = cat_codes            # int64 → categories[]
+        self.merchant_codes = merchant_codes  # int64 → merchants[]
+        self.categories = categories
+        self.merchants = merchants
+
+    def __len__(self):
+        return len(self.txns)
+
+    @classmethod
+    def from_txns(cls, txns: List[Txn], merchants: Optional[Dict[Optional[str], Merchant]] = None) -> "TxnColumns":
+        return columns_for_batch([txns], merchants)[0]
+
+    # --- derived columns (computed lazily, cached) ---
+
+    @property
+    def weekday(self) -> np.ndarray:
+        if not hasattr(self, "_weekday"):
+            # 1970-01-01 was a Thursday (weekday 3)
+            self._weekday = (self.date_us // _DAY_US + 3) % 7
+        return self._weekday
+
+    @property
+    def hour(self) -> np.ndarray:
+        if not hasattr(self, "_hour"):
+            self._hour = (self.date_us // _HOUR_US) % 24
+        return self._hour
+
+    @property
+    def month(self) -> np.ndarray:
+        """Months since 1970-01 (sorts like the "YYYY-MM" keys)."""
+        if not hasattr(self, "_month"):
+            months = self.date_us.astype("datetime64[us]").astype("datetime64[M]")
+            self._month = months.astype(np.int64)
+        return self._month
+
+
+def columns_for_batch(
+    batch: List[List[Txn]],
+    merchants: Optional[Dict[Optional[str], Merchant]] = None
+) -> List[TxnColumns]:
+    """
+    Converts several users' transaction lists into columnar arrays in
+    one go and returns a per-user TxnColumns (views into shared arrays).
+    `merchants` is an optional load_merchants mapping.
+    """
+    flat = [t for txns in batch for t in txns]
+
+    cat_index: Dict[str, int] = {}
+    merchant_index: Dict[str, int] = {}
+
+    amount = np.fromiter((t.amount for t in flat), dtype=np.float64, count=len(flat))
+    is_debit = np.fromiter((t.type == "DEBIT" for t in flat), dtype=bool, count=len(flat))
+    is_credit = np.fromiter((t.type == "CREDIT" for t in flat), dtype=bool, count=len(flat))
+    date_us = np.array([t.date for t in flat], dtype="datetime64[us]").astype(np.int64)
+    cat_codes = np.fromiter(
+        (cat_index.setdefault(t.category, len(cat_index)) for t in flat),
+        dtype=np.int64, count=len(flat),
+    )
+    # Merchant totals only cover debits; group them by canonical
+    # merchant, named by its display name
+    names = merchant_names((t.merchant for t in flat if t.type == "DEBIT"), merchants)
+    display = {raw: name[1] for raw, name in names.items()}
+    merchant_codes = np.fromiter(
+        (merchant_index.setdefault(display.get(t.merchant, t.merchant), len(merchant_index))
+         for t in flat),
+        dtype=np.int64, count=len(flat),
+    )
+
+    categories = list(cat_index)
+    merchants = list(merchant_index)
+
+    columns = []
+    start = 0
+    for txns in batch:
+        end = start + len(txns)
+        columns.append(TxnColumns(
+            txns,
+            amount[start:end], is_debit[start:end], is_credit[start:end], date_us[start:end],
+            cat_codes[start:end], merchant_codes[start:end],
+            categories, merchants,
+        ))
+        start = end
+
+    return columns
+
+
+# ------------------------------------------------------------
+# HELPERS
+# ------------------------------------------------------------
+
+def _seq_sum(values: np.ndarray):
+    """Left-to-right sum, bit-identical to Python's sum(); 0 when empty."""
+    if len(values) == 0:
+        return 0
+    return float(np.cumsum(values)[-1])
+
+
+def _first_appearance(codes: np.ndarray) -> np.ndarray:
+    """Distinct codes ordered by first occurrence (dict insertion order)."""
+    if len(codes) == 0:
+        return codes
+    uniq, first = np.unique(codes, return_index=True)
+    return uniq[np.argsort(first, kind="stable")]
+
+
+def _grouped_sums(codes: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-group sums accumulated in row order.
+    Returns (distinct codes, first row index of each, sums).
+    """
+    uniq, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    sums = np.zeros(len(uniq), dtype=np.float64)
+    np.add.at(sums, inverse, values)
+    return uniq, first, sums
+
+
+def _largest(codes: np.ndarray, values: np.ndarray, names: List[str]) -> Optional[str]:
+    """Key with the highest total; ties go to the first-seen key, as in max(dict)."""
+    if len(codes) == 0:
+        return None
+    uniq, first, sums = _grouped_sums(codes, values)
+    order = np.argsort(first, kind="stable")
+    best = order[int(np.argmax(sums[order]))]
+    return names[int(uniq[best])]
+
+
+# ------------------------------------------------------------
+# ANOMALIES
+# ------------------------------------------------------------
+
+def compute_baselines(cols: TxnColumns) -> Dict[str, Dict[str, float]]:
+    debit_codes = cols.cat_codes[cols.is_debit]
+    debit_amounts = cols.amount[cols.is_debit]
+
+    # Stable sort keeps each category's amounts in transaction order
+    order = np.argsort(debit_codes, kind="stable")
+    sorted_codes = debit_codes[order]
+    sorted_amounts = debit_amounts[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(sorted_codes)]))
+
+    by_code = {}
+    for start, end in zip(starts, ends):
+        if start == end:
+            continue
+        amounts = sorted_amounts[start:end].tolist()
+        by_code[int(sorted_codes[start])] = {
+            "avg": statistics.mean(amounts),
+            "std": _std(amounts),
+        }
+
+    return {cols.categories[int(c)]: by_code[int(c)] for c in _first_appearance(debit_codes)}
+
+
+def detect_anomalies(txns: List[Txn], cols: Optional[TxnColumns] = None) -> List[Dict[str, Any]]:
+    anomalies = []
+
+    if not txns:
+        return anomalies
+
+    if cols is None:
+        cols = TxnColumns.from_txns(txns)
+    baselines = compute_baselines(cols)
+
+    avg = np.zeros(len(cols.categories))
+    std = np.zeros(len(cols.categories))
+    for cat, base in baselines.items():
+        code = cols.categories.index(cat)
+        avg[code] = base["avg"]
+        std[code] = base["std"]
+
+    row_avg = avg[cols.cat_codes]
+    row_std = std[cols.cat_codes]
+
+    flagged = cols.is_debit & (row_std != 0) & (cols.amount > row_avg + 2.5 * row_std)
+
+    for i in np.flatnonzero(flagged):
+        t = txns[int(i)]
+        cat = t.category
+        anomalies.append({
+            "amount": t.amount,
+            "category": cat,
+            "merchant": t.merchant,
+            "narration": t.narration,
+            "date": t.date.isoformat(),
+            "reason": f"Unusually high compared to your typical {cat} spending."
+        })
+
+    return anomalies
+
+
+# ------------------------------------------------------------
+# PREDICTION
+# ------------------------------------------------------------
+
+def _month_key(month: int) -> str:
+    year, m = divmod(int(month), 12)
+    return f"{1970 + year}-{m + 1:02d}"
+
+
+def _monthly_series(months: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Chronological (months, sums) for one group of debits."""
+    present, _, sums = _grouped_sums(months, amounts)
+    return present, sums
+
+
+def group_by_month(cols: TxnColumns) -> Dict[str, float]:
+    months = cols.month[cols.is_debit]
+    amounts = cols.amount[cols.is_debit]
+    present, sums = _monthly_series(months, amounts)
+    return {_month_key(m): float(v) for m, v in zip(present, sums)}
+
+
+def predict_category(cols: TxnColumns) -> Dict[str, float]:
+    codes = cols.cat_codes[cols.is_debit]
+    months = cols.month[cols.is_debit]
+    amounts = cols.amount[cols.is_debit]
+
+    categories = {}
+    for code in _first_appearance(codes):
+        mask = codes == code
+        _, sums = _monthly_series(months[mask], amounts[mask])
+        predicted = _predict_next_value(sums.tolist())
+        categories[cols.categories[int(code)]] = round(predicted, 2)
+
+    return categories
+
+
+def predict_future(txns: List[Txn], cols: Optional[TxnColumns] = None) -> Dict[str, Any]:
+    if cols is None:
+        cols = TxnColumns.from_txns(txns)
+    monthly = group_by_month(cols)
+
+    if not monthly:
+        return {
+            "predicted_total_next_month": 0,
+            "average_monthly_spend": 0,
+            "trend": "flat",
+            "category_predictions": {}
+        }
+
+    # Keys come out of np.unique already in chronological order
+    values = list(monthly.values())
+
+    avg_spend = statistics.mean(values)
+    prediction = _predict_next_value(values)
+
+    if len(values) >= 2:
+        if values[-1] > values[-2] * 1.1:
+            trend = "rising"
+        elif values[-1] < values[-2] * 0.9:
+            trend = "falling"
+        else:
+            trend = "flat"
+    else:
+        trend = "flat"
+
+    return {
+        "predicted_total_next_month": round(prediction, 2),
+        "average_monthly_spend": round(avg_spend, 2),
+        "trend": trend,
+        "category_predictions": predict_category(cols)
+    }
+
+
+# ------------------------------------------------------------
+# INSIGHTS
+# ------------------------------------------------------------
+
+def generate_summary(cols: TxnColumns, now: Optional[datetime] = None) -> Dict[str, Any]:
+    if len(cols) == 0:
+        return {
+            "total_spent_30d": 0,
+            "total_received_30d": 0,
+            "largest_category": None,
+            "largest_merchant": None,
+            "daily_avg_spend": 0,
+        }
+
+    now = now or datetime.utcnow()
+    now_us = np.datetime64(now, "us").astype(np.int64)
+
+    # Same as (now - date).days <= 30 (timedelta.days floors)
+    recent = (now_us - cols.date_us) // _DAY_US <= 30
+    debit = recent & cols.is_debit
+    credit = recent & cols.is_credit
+
+    total_spent = _seq_sum(cols.amount[debit])
+    total_received = _seq_sum(cols.amount[credit])
+
+    return {
+        "total_spent_30d": round(total_spent, 2),
+        "total_received_30d": round(total_received, 2),
+        "largest_category": _largest(cols.cat_codes[debit], cols.amount[debit], cols.categories),
+        "largest_merchant": _largest(cols.merchant_codes[debit], cols.amount[debit], cols.merchants),
+        "daily_avg_spend": round(total_spent / 30, 2),
+    }
+
+
+def _category_mask(cols: TxnColumns, name: str) -> np.ndarray:
+    if name not in cols.categories:
+        return np.zeros(len(cols), dtype=bool)
+    return cols.cat_codes == cols.categories.index(name)
+
+
+def detect_patterns(cols: TxnColumns) -> List[str]:
+    patterns = []
+
+    if len(cols) == 0:
+        return patterns
+
+    debit = cols.is_debit
+    weekend_mask = cols.weekday >= 5
+
+    weekend = _seq_sum(cols.amount[debit & weekend_mask])
+    weekday = _seq_sum(cols.amount[debit & ~weekend_mask])
+
+    if weekend > weekday:
+        patterns.append("You tend to spend more on weekends.")
+    else:
+        patterns.append("You spend more during weekdays.")
+
+    evening = _seq_sum(cols.amount[debit & (cols.hour >= 18)])
+    if evening > _seq_sum(cols.amount) * 0.35:
+        patterns.append("Your evening spending is higher than usual.")
+
+    food_total = _seq_sum(cols.amount[_category_mask(cols, "Food")])
+    if food_total > 2000:
+        patterns.append("Your food expenses are consistently high.")
+
+    return patterns
+
+
+def generate_alerts(cols: TxnColumns, anomalies: List[Dict[str, Any]]) -> List[str]:
+    alerts = []
+
+    food_spend = _seq_sum(cols.amount[_category_mask(cols, "Food")])
+    if food_spend > 3000:
+        alerts.append("Food spending is significantly higher than usual.")
+
+    transport_spend = _seq_sum(cols.amount[_category_mask(cols, "Transport")])
+    if transport_spend > 2000:
+        alerts.append("Transport costs seem unusually high.")
+
+    for a in anomalies:
+        alerts.append(f"Unusual spending detected: {a['merchant']} - ₹{a['amount']}")
+
+    return alerts
+
+
+def generate_insights(
+    txns: List[Txn],
+    subs: List[Dict[str, Any]],
+    anomalies: List[Dict[str, Any]],
+    prediction: Dict[str, Any],
+    cols: Optional[TxnColumns] = None
+) -> Dict[str, Any]:
+    if cols is None:
+        cols = TxnColumns.from_txns(txns)
+
+    summary = generate_summary(cols)
+    patterns = detect_patterns(cols)
+    alerts = generate_alerts(cols, anomalies)
+    recommendations = generate_recommendations(summary, subs)
+
+    return {
+        "summary": summary,
+        "patterns": patterns,
+        "alerts": alerts,
+        "subscriptions": subs,
+        "anomalies": anomalies,
+        "prediction": prediction,
+        "recommendations": recommendations,
+        "generated_at": datetime.utcnow().isoformat() + "Z"
+    }
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.agent_config import STREAM_BUFFER_SIZE, STREAM_MAX_CLIENTS_PER_USER
+
+# ------------------------------------------------------------
+# IN-PROCESS PUB/SUB (ingest → live streams)
+# ------------------------------------------------------------
+#
+# save_fi_data publishes the anomalies it finds under the userId; every
+# open /fiu/stream/{user_id} response holds a Subscription and relays
+# them as Server-Sent Events.
+#
+# Publishing never blocks ingest: each subscriber has a bounded buffer,
+# and a subscriber that falls behind loses its oldest events instead of
+# holding up the sync. The loss is counted and reported to the client on
+# its next read, so it can refetch /fiu/insights. Publishers run in any
+# thread; subscribers are read from the asyncio event loop.
+
+
+class Subscription:
+    """One stream's bounded event buffer."""
+
+    def __init__(self, bus: "EventBus", topic: str, maxsize: int, loop: asyncio.AbstractEventLoop):
+        self.bus = bus
+        self.topic = topic
+        self.maxsize = maxsize
+
+        self._items = deque()
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def put(self, item: Any) -> bool:
+        """
+        Buffers an event, dropping the oldest one when full. Safe from
+        any thread. Returns False once the subscriber's loop is gone.
+        """
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self._dropped += 1
+            self._items.append(item)
+
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            return False  # event loop closed
+        return True
+
+    async def get(self, timeout: float) -> Tuple[List[Any], int]:
+        """
+        Waits up to `timeout` seconds for events and returns everything
+        buffered plus how many events were dropped since the last call.
+        Returns ([], 0) on timeout.
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                if self._items or self._dropped:
+                    self._ready.clear()
+                    items, self._items = list(self._items), deque()
+                    dropped, self._dropped = self._dropped, 0
+                    return items, dropped
+                self._ready.clear()
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], 0
+
+            try:
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, buffer_size: int = STREAM_BUFFER_SIZE, max_subscribers: int = STREAM_MAX_CLIENTS_PER_USER):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str) -> Optional[Subscription]:
+        """
+        New subscription for `topic`, bound to the running event loop.
+        Returns None when the topic already has max_subscribers.
+        """
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            subscribers = self._subscribers.setdefault(topic, set())
+            if len(subscribers) >= self.max_subscribers:
+                return None
+
+            subscription = Subscription(self, topic, self.buffer_size, loop)
+            subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.topic]
+
+    def publish(self, topic: str, items: List[Any]) -> int:
+        """Fans events out to the topic's subscribers; returns how many got them."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        delivered = 0
+        for subscription in subscribers:
+            alive = True
+            for item in items:
+                alive = subscription.put(item)
+                if not alive:
+                    break
+
+            if alive:
+                delivered += 1
+            else:
+                self.unsubscribe(subscription)
+
+        return delivered
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "topics": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+            }
+
+
+# Process-wide bus for anomalies found at ingest, keyed by userId
+anomaly_bus = EventBus()
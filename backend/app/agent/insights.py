@@ -1,11 +1,79 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 
+from app.agent.loader import Txn
+from app.agent.merchants import Merchant, merchant_names
+
+# ------------------------------------------------------------
+# FUSED AGGREGATES (one pass feeds summary, patterns and alerts)
+# ------------------------------------------------------------
+#
+# Amounts are collected per bucket and summed with sum() at the end, so
+# every total is added in the same order as the per-function scans it
+# replaces and the output stays bit-for-bit identical.
+
+def aggregate_txns(
+    txns: List[Txn],
+    now: Optional[datetime] = None,
+    merchants: Optional[Dict[Optional[str], Merchant]] = None
+) -> Dict[str, Any]:
+    now = now or datetime.utcnow()
+
+    all_amounts, weekend, weekday, evening = [], [], [], []
+    food, transport = [], []
+    spent_30d, received_30d = [], []
+    by_category = {}
+    by_merchant = {}  # canonical merchants, by display name
+
+    merchants = merchant_names((t.merchant for t in txns if t.type == "DEBIT"), merchants)
+
+    for t in txns:
+        amount = t.amount
+        category = t.category
+
+        all_amounts.append(amount)
+
+        if category == "Food":
+            food.append(amount)
+        elif category == "Transport":
+            transport.append(amount)
+
+        if t.type == "DEBIT":
+            date = t.date
+            (weekend if date.weekday() >= 5 else weekday).append(amount)
+
+            if date.hour >= 18:
+                evening.append(amount)
+
+            # 30-day window
+            if (now - date).days <= 30:
+                spent_30d.append(amount)
+                by_category[category] = by_category.get(category, 0) + amount
+                merchant = merchants[t.merchant][1]
+                by_merchant[merchant] = by_merchant.get(merchant, 0) + amount
+
+        elif t.type == "CREDIT" and (now - t.date).days <= 30:
+            received_30d.append(amount)
+
+    return {
+        "total": sum(all_amounts),
+        "weekend_spend": sum(weekend),
+        "weekday_spend": sum(weekday),
+        "evening_spend": sum(evening),
+        "food_spend": sum(food),
+        "transport_spend": sum(transport),
+        "spent_30d": sum(spent_30d),
+        "received_30d": sum(received_30d),
+        "by_category_30d": by_category,
+        "by_merchant_30d": by_merchant,
+    }
+
+
 # ------------------------------------------------------------
 # SUMMARY GENERATION
 # ------------------------------------------------------------
 
-def generate_summary(txns: List[Dict[str, Any]]) -> Dict[str, Any]:
+def generate_summary(txns: List[Txn], agg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     High-level 30-day financial summary.
     """
@@ -18,25 +86,12 @@ def generate_summary(txns: List[Dict[str, Any]]) -> Dict[str, Any]:
             "daily_avg_spend": 0,
         }
 
-    # 30-day filter
-    now = datetime.utcnow()
-    days_30_txns = [
-        t for t in txns
-        if (now - t["date"]).days <= 30
-    ]
-
-    total_spent = sum(t["amount"] for t in days_30_txns if t["type"] == "DEBIT")
-    total_received = sum(t["amount"] for t in days_30_txns if t["type"] == "CREDIT")
-
-    by_category = {}
-    by_merchant = {}
-
-    for t in days_30_txns:
-        if t["type"] != "DEBIT":
-            continue
+    agg = agg or aggregate_txns(txns)
 
-        by_category[t["category"]] = by_category.get(t["category"], 0) + t["amount"]
-        by_merchant[t["merchant"]] = by_merchant.get(t["merchant"], 0) + t["amount"]
+    total_spent = agg["spent_30d"]
+    total_received = agg["received_30d"]
+    by_category = agg["by_category_30d"]
+    by_merchant = agg["by_merchant_30d"]
 
     largest_category = max(by_category, key=by_category.get) if by_category else None
     largest_merchant = max(by_merchant, key=by_merchant.get) if by_merchant else None
@@ -54,29 +109,26 @@ def generate_summary(txns: List[Dict[str, Any]]) -> Dict[str, Any]:
 # PATTERN DETECTION (simple but effective)
 # ------------------------------------------------------------
 
-def detect_patterns(txns: List[Dict[str, Any]]) -> List[str]:
+def detect_patterns(txns: List[Txn], agg: Optional[Dict[str, Any]] = None) -> List[str]:
     patterns = []
 
     if not txns:
         return patterns
 
-    # Weekend pattern
-    weekend = sum(t["amount"] for t in txns if t["type"] == "DEBIT" and t["date"].weekday() >= 5)
-    weekday = sum(t["amount"] for t in txns if t["type"] == "DEBIT" and t["date"].weekday() < 5)
+    agg = agg or aggregate_txns(txns)
 
-    if weekend > weekday:
+    # Weekend pattern
+    if agg["weekend_spend"] > agg["weekday_spend"]:
         patterns.append("You tend to spend more on weekends.")
     else:
         patterns.append("You spend more during weekdays.")
 
     # Evening spending
-    evening = sum(t["amount"] for t in txns if t["type"] == "DEBIT" and t["date"].hour >= 18)
-    if evening > sum(t["amount"] for t in txns) * 0.35:
+    if agg["evening_spend"] > agg["total"] * 0.35:
         patterns.append("Your evening spending is higher than usual.")
 
     # Food habits
-    food_total = sum(t["amount"] for t in txns if t["category"] == "Food")
-    if food_total > 2000:
+    if agg["food_spend"] > 2000:
         patterns.append("Your food expenses are consistently high.")
 
     return patterns
@@ -86,16 +138,20 @@ def detect_patterns(txns: List[Dict[str, Any]]) -> List[str]:
 # ALERTS (Based on thresholds + anomalies)
 # ------------------------------------------------------------
 
-def generate_alerts(txns: List[Dict[str, Any]], anomalies: List[Dict[str, Any]]) -> List[str]:
+def generate_alerts(
+    txns: List[Txn],
+    anomalies: List[Dict[str, Any]],
+    agg: Optional[Dict[str, Any]] = None
+) -> List[str]:
     alerts = []
 
+    agg = agg or aggregate_txns(txns)
+
     # High Category Spending Alerts
-    food_spend = sum(t["amount"] for t in txns if t["category"] == "Food")
-    if food_spend > 3000:
+    if agg["food_spend"] > 3000:
         alerts.append("Food spending is significantly higher than usual.")
 
-    transport_spend = sum(t["amount"] for t in txns if t["category"] == "Transport")
-    if transport_spend > 2000:
+    if agg["transport_spend"] > 2000:
         alerts.append("Transport costs seem unusually high.")
 
     # Add anomaly alerts
@@ -132,17 +188,20 @@ def generate_recommendations(summary, subs):
 # ------------------------------------------------------------
 
 def generate_insights(
-    txns: List[Dict[str, Any]],
+    txns: List[Txn],
     subs: List[Dict[str, Any]],
     anomalies: List[Dict[str, Any]],
-    prediction: Dict[str, Any]
+    prediction: Dict[str, Any],
+    merchants: Optional[Dict[Optional[str], Merchant]] = None
 ) -> Dict[str, Any]:
     """
     Combines all intelligence into a single insights JSON.
     """
-    summary = generate_summary(txns)
-    patterns = detect_patterns(txns)
-    alerts = generate_alerts(txns, anomalies)
+    agg = aggregate_txns(txns, merchants=merchants)
+
+    summary = generate_summary(txns, agg)
+    patterns = detect_patterns(txns, agg)
+    alerts = generate_alerts(txns, anomalies, agg)
     recommendations = generate_recommendations(summary, subs)
 
     return {
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.agent_config import INSIGHTS_BATCH_SIZE, INSIGHTS_FLUSH_SECONDS
+from app.agent.metrics import agent_metrics
+from app.agent.registry import mark_processed
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# SCHEMA (run once at startup, not per write)
+# ------------------------------------------------------------
+
+def init_insights_table(cur: sqlite3.Cursor):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS insights (
+            userId TEXT,
+            generatedAt TEXT,
+            insightsJson TEXT
+        );
+    """)
+
+    # Latest payload hash per user, to skip rewriting identical insights
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS insights_state (
+            userId TEXT PRIMARY KEY,
+            payloadHash TEXT,
+            lastConfirmedAt TEXT
+        );
+    """)
+
+
+# ------------------------------------------------------------
+# CONTENT HASH
+# ------------------------------------------------------------
+
+def insights_hash(insights: Dict[str, Any]) -> str:
+    """
+    Stable hash of an insights payload, ignoring generated_at.
+    """
+    payload = {k: v for k, v in insights.items() if k != "generated_at"}
+    blob = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def load_last_confirmed(user_id: str) -> Optional[str]:
+    """
+    When the user's latest stored insights were last recomputed
+    and found unchanged (or written).
+    """
+    conn = sqlite3.connect(FIU_DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT lastConfirmedAt FROM insights_state WHERE userId = ?", (user_id,))
+    row = cur.fetchone()
+
+    conn.close()
+    return row[0] if row else None
+
+
+# ------------------------------------------------------------
+# BUFFERED INSIGHTS WRITER
+# ------------------------------------------------------------
+
+class InsightsWriter:
+    """
+    Accumulates per-user insights and writes them with executemany,
+    one transaction per batch. A batch is flushed once it holds
+    `max_batch` users or its oldest entry is `max_age_seconds` old.
+
+    A row is only inserted when the payload hash (generated_at excluded)
+    differs from the user's last stored one; otherwise just the user's
+    lastConfirmedAt moves forward.
+
+    When a `watermark` is given, the users' lastProcessedAt is advanced
+    in the same transaction, so insights and watermarks never disagree.
+
+    Usage:
+        with InsightsWriter(watermark) as writer:
+            writer.add(user_id, insights)   # insights may be None
+    """
+
+    def __init__(
+        self,
+        watermark: Optional[str] = None,
+        max_batch: int = INSIGHTS_BATCH_SIZE,
+        max_age_seconds: float = INSIGHTS_FLUSH_SECONDS,
+    ):
+        self.watermark = watermark
+        self.max_batch = max(1, max_batch)
+        self.max_age_seconds = max_age_seconds
+
+        self._conn = sqlite3.connect(FIU_DB)
+        self._rows: List[Tuple[str, str, str, str]] = []
+        self._processed: List[str] = []
+        self._oldest: Optional[float] = None
+
+        self.written = 0
+        self.unchanged = 0
+        self.flushes = 0
+
+    def add(self, user_id: str, insights: Optional[Dict[str, Any]]):
+        """
+        Buffers one user's result. None means the user was processed
+        but produced nothing to store (e.g. no transactions).
+        """
+        if insights is not None:
+            self._rows.append((
+                user_id,
+                insights["generated_at"],
+                str(insights),   # stored as string (simple storage)
+                insights_hash(insights)
+            ))
+        self._processed.append(user_id)
+
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        if (len(self._processed) >= self.max_batch
+                or time.monotonic() - self._oldest >= self.max_age_seconds):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes everything buffered in a single transaction.
+        Returns the number of insights rows inserted.
+        """
+        if not self._processed:
+            return 0
+
+        with agent_metrics.timed("save"):
+            count = self._write()
+
+        self.written += count
+        self.unchanged += len(self._rows) - count
+        self.flushes += 1
+
+        self._rows = []
+        self._processed = []
+        self._oldest = None
+
+        return count
+
+    def _load_hashes(self, cur: sqlite3.Cursor, user_ids: List[str]) -> Dict[str, str]:
+        hashes = {}
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            cur.execute(
+                f"SELECT userId, payloadHash FROM insights_state "
+                f"WHERE userId IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            hashes.update(cur.fetchall())
+        return hashes
+
+    def _write(self) -> int:
+        cur = self._conn.cursor()
+
+        stored = self._load_hashes(cur, [row[0] for row in self._rows])
+        changed = [row for row in self._rows if stored.get(row[0]) != row[3]]
+
+        cur.executemany("""
+            INSERT INTO insights (userId, generatedAt, insightsJson)
+            VALUES (?, ?, ?)
+        """, [row[:3] for row in changed])
+
+        cur.executemany("""
+            INSERT INTO insights_state (userId, payloadHash, lastConfirmedAt)
+            VALUES (?, ?, ?)
+            ON CONFLICT(userId) DO UPDATE SET
+                payloadHash = excluded.payloadHash,
+                lastConfirmedAt = excluded.lastConfirmedAt;
+        """, [(user_id, digest, generated_at) for user_id, generated_at, _, digest in self._rows])
+
+        if self.watermark is not None:
+            mark_processed(cur, self._processed, self.watermark)
+
+        self._conn.commit()
+        return len(changed)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep what was already committed, drop the partial batch
+            self._conn.rollback()
+            self._conn.close()
+        return False
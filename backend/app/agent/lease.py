@@ -0,0 +1,88 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from app.agent_config import AGENT_LEASE_SECONDS
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# CROSS-PROCESS RUN LEASE (stored in fiu.db)
+# ------------------------------------------------------------
+#
+# Any number of processes (API workers, standalone agent workers) may
+# try to run the agent; only the holder of the lease actually runs.
+# A lease expires after `ttl` seconds unless renewed, so a crashed
+# holder never blocks the agent for longer than that.
+
+def init_lease_table(cur: sqlite3.Cursor):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS agent_lease (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expiresAt REAL
+        );
+    """)
+
+
+class AgentLease:
+    def __init__(self, name: str = "agent-run", ttl: float = AGENT_LEASE_SECONDS):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renewed_at = 0.0
+
+    def acquire(self) -> bool:
+        """
+        Takes (or extends) the lease if it is free, expired or already ours.
+        Returns True when this process holds it.
+        """
+        now = time.time()
+
+        conn = sqlite3.connect(FIU_DB, timeout=10)
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(
+                "INSERT OR IGNORE INTO agent_lease (name, owner, expiresAt) VALUES (?, NULL, 0)",
+                (self.name,),
+            )
+            cur.execute("""
+                UPDATE agent_lease
+                SET owner = ?, expiresAt = ?
+                WHERE name = ? AND (owner = ? OR owner IS NULL OR expiresAt < ?)
+            """, (self.owner, now + self.ttl, self.name, self.owner, now))
+            held = cur.rowcount == 1
+            conn.commit()
+        finally:
+            conn.close()
+
+        if held:
+            self._renewed_at = now
+        return held
+
+    def renew(self) -> bool:
+        """
+        Extends the lease, but only touches the DB once a third of the
+        TTL has passed. Returns False if the lease was lost.
+        """
+        if time.time() - self._renewed_at < self.ttl / 3:
+            return True
+        return self.acquire()
+
+    def release(self):
+        conn = sqlite3.connect(FIU_DB, timeout=10)
+        try:
+            conn.execute(
+                "UPDATE agent_lease SET owner = NULL, expiresAt = 0 WHERE name = ? AND owner = ?",
+                (self.name, self.owner),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._renewed_at = 0.0
+
+
+# One lease per process guards every agent run
+run_lease = AgentLease()
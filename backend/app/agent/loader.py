@@ -1,6 +1,8 @@
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any
+from datetime import datetime, timedelta, timezone
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from app.db_config import FIU_DB as DB_FILE
 
 def _parse_iso(dt_str: str) -> datetime:
@@ -10,48 +12,404 @@ def _parse_iso(dt_str: str) -> datetime:
     return datetime.fromisoformat(dt_str)
 
 
-def load_transactions(user_id: str, limit: int = 200) -> List[Dict[str, Any]]:
+# ------------------------------------------------------------
+# EPOCH TIMESTAMPS (transactions.valueTs)
+# ------------------------------------------------------------
+#
+# valueDate stays the source of truth for display; valueTs holds the
+# same instant as integer microseconds since the Unix epoch (UTC) so
+# sorts and range filters compare integers instead of TEXT.
+#
+# Rows whose valueDate does not parse keep a NULL valueTs and are left
+# out of every history query (they could not become a Txn anyway); they
+# are reported when stored and when the column is backfilled.
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_epoch_us(value) -> Optional[int]:
+    """
+    ISO 8601 string or datetime -> epoch microseconds (naive = UTC).
+    Returns None for values that do not parse.
+    """
+    if isinstance(value, str):
+        try:
+            value = _parse_iso(value)
+        except ValueError:
+            return None
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def init_value_ts(cur: sqlite3.Cursor):
+    """
+    Adds and backfills transactions.valueTs on databases created before
+    it existed. Idempotent; rows that already have valueTs are skipped.
+    """
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(transactions)")}
+    if "valueTs" not in columns:
+        cur.execute("ALTER TABLE transactions ADD COLUMN valueTs INTEGER")
+
+    cur.connection.create_function("to_epoch_us", 1, to_epoch_us, deterministic=True)
+    cur.execute("""
+        UPDATE transactions SET valueTs = to_epoch_us(valueDate)
+        WHERE valueTs IS NULL AND valueDate IS NOT NULL
+    """)
+
+    unparsed = cur.execute("SELECT COUNT(*) FROM transactions WHERE valueTs IS NULL").fetchone()[0]
+    if unparsed:
+        print(f"[DB] WARNING: {unparsed} transactions have a missing or unparseable valueDate; "
+              f"the agent skips them.")
+
+
+# ------------------------------------------------------------
+# COMPACT TRANSACTION RECORD
+# ------------------------------------------------------------
+
+class Txn:
+    """
+    Slotted transaction record used by the whole agent pipeline.
+    Roughly a quarter of the memory of the equivalent six-key dict,
+    with plain attribute access (t.amount, t.date, ...).
+
+    Dict-style access (t["amount"], t.get("merchant")) is kept as a
+    compatibility shim for older callers.
+    """
+
+    __slots__ = ("amount", "type", "category", "merchant", "narration", "date")
+
+    def __init__(self, amount: float, type: str, category: str,
+                 merchant: str, narration: str, date: datetime):
+        self.amount = amount
+        self.type = type
+        self.category = category
+        self.merchant = merchant
+        self.narration = narration
+        self.date = date
+
+    # --- dict compatibility shim ---
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Txn":
+        return cls(d["amount"], d["type"], d["category"], d["merchant"], d["narration"], d["date"])
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Txn):
+            return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None  # mutable (categorize_batch relabels in place)
+
+    def __repr__(self) -> str:
+        return f"Txn({self.to_dict()!r})"
+
+
+# ------------------------------------------------------------
+# STORED CATEGORIES
+# ------------------------------------------------------------
+#
+# Categories are computed at ingest and stamped with the rules version
+# (transactions.categoryVersion). Loaders given `category_version` only
+# trust categories stamped with it; anything older comes back as None
+# for the agent to recategorize (categorizer.categorize_stale).
+
+def _category_sql(category_version: Optional[str]) -> Tuple[str, List[Any]]:
+    """SELECT expression (and its parameters) for the category column."""
+    if category_version is None:
+        return "COALESCE(NULLIF(category, ''), 'Uncategorized')", []
+    return (
+        "CASE WHEN categoryVersion = ? THEN COALESCE(NULLIF(category, ''), 'Uncategorized') END",
+        [category_version],
+    )
+
+
+def _row_to_txn(amount, txn_type, category, merchant, narration, value_date) -> Txn:
+    return Txn(
+        float(amount),
+        txn_type,
+        category,
+        merchant or "",
+        narration or "",
+        _parse_iso(value_date),
+    )
+
+
+def load_transactions(
+    user_id: str,
+    limit: int = 200,
+    category_version: Optional[str] = None
+) -> List[Txn]:
     """
     Load the most recent transactions for a specific user from the FIU database.
 
-    Returns a list of dicts:
-    {
-        "amount": float,
-        "type": "DEBIT" | "CREDIT",
-        "category": str,
-        "merchant": str,
-        "narration": str,
-        "date": datetime
-    }
+    Returns a list of Txn records:
+        amount: float
+        type: "DEBIT" | "CREDIT"
+        category: str
+        merchant: str
+        narration: str
+        date: datetime
     """
+    category, category_params = _category_sql(category_version)
+
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
 
     cur.execute(
-        """
-        SELECT amount, txnType, category, merchant, narration, valueDate
+        f"""
+        SELECT amount, txnType, {category}, merchant, narration, valueDate
         FROM transactions
-        WHERE userId = ?
-        ORDER BY valueDate DESC
+        WHERE userId = ? AND valueTs IS NOT NULL
+        ORDER BY valueTs DESC
         LIMIT ?
         """,
-        (user_id, limit),
+        category_params + [user_id, limit],
     )
 
     rows = cur.fetchall()
     conn.close()
 
-    txns: List[Dict[str, Any]] = []
-    for amount, txn_type, category, merchant, narration, value_date in rows:
-        txns.append(
-            {
-                "amount": float(amount),
-                "type": txn_type,
-                "category": category or "Uncategorized",
-                "merchant": merchant or "",
-                "narration": narration or "",
-                "date": _parse_iso(value_date),
-            }
-        )
-
-    return txns
+    return [_row_to_txn(*row) for row in rows]
+
+
+# ------------------------------------------------------------
+# BULK LOADER (one connection for many users)
+# ------------------------------------------------------------
+
+def iter_user_transactions(
+    user_ids: Optional[List[str]] = None,
+    limit: int = 200,
+    chunk_size: int = 500,
+    category_version: Optional[str] = None,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Iterator[Tuple[str, List[Txn]]]:
+    """
+    Streams (userId, transactions) groups for many users over a single
+    connection. Each group matches what load_transactions(userId, limit)
+    returns: the user's `limit` most recent transactions, newest first.
+
+    user_ids=None streams every user in one query straight off the cursor,
+    which keeps a read lock open until the generator is exhausted. With
+    explicit user_ids, users are queried in chunks of `chunk_size` (also
+    keeping under SQLite's variable cap) and each chunk is fetched before
+    its groups are yielded, so callers may write to the DB in between.
+    Users without transactions are not yielded. Reads through `conn`
+    (left open) when given.
+    """
+    category, category_params = _category_sql(category_version)
+
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+
+    try:
+        if user_ids is None:
+            chunks = [None]
+        else:
+            chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+        for chunk in chunks:
+            if chunk is None:
+                where, params = "WHERE valueTs IS NOT NULL", []
+            else:
+                where = f"WHERE userId IN ({', '.join('?' * len(chunk))}) AND valueTs IS NOT NULL"
+                params = list(chunk)
+
+            cur.execute(
+                f"""
+                SELECT userId, amount, txnType, category, merchant, narration, valueDate
+                FROM (
+                    SELECT userId, amount, txnType, {category} AS category, merchant, narration, valueDate, valueTs,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY userId ORDER BY valueTs DESC
+                           ) AS rn
+                    FROM transactions
+                    {where}
+                )
+                WHERE rn <= ?
+                ORDER BY userId, valueTs DESC
+                """,
+                category_params + params + [limit],
+            )
+
+            rows = cur if chunk is None else cur.fetchall()
+
+            # Rows arrive grouped by user; decode one user at a time
+            for user_id, group in groupby(rows, key=itemgetter(0)):
+                yield user_id, [_row_to_txn(*row[1:]) for row in group]
+    finally:
+        if own_conn:
+            conn.close()
+
+
+# ------------------------------------------------------------
+# FULL HISTORY (keyset pagination, bounded memory per page)
+# ------------------------------------------------------------
+
+_DAY_US = 86_400_000_000
+
+
+def history_start(conn: sqlite3.Connection, user_id: str, days: Optional[float]) -> int:
+    """
+    Oldest valueTs inside a user's window (0 = no window). The window
+    ends at the user's newest transaction rather than now, so users who
+    stopped syncing still get their last `days` days analysed.
+    """
+    if not days:
+        return 0
+
+    newest = conn.execute(
+        "SELECT MAX(valueTs) FROM transactions WHERE userId = ?", (user_id,)
+    ).fetchone()[0]
+    if newest is None:
+        return 0
+    return newest - int(days * _DAY_US)
+
+
+def iter_transaction_pages(
+    user_id: str,
+    days: Optional[float] = None,
+    page_size: int = 500,
+    conn: Optional[sqlite3.Connection] = None,
+    category_version: Optional[str] = None,
+) -> Iterator[List[Txn]]:
+    """
+    Pages through a user's history newest first, `page_size` rows at a
+    time, optionally limited to the `days` days up to their newest
+    transaction.
+
+    Keyset pagination on (valueTs, txnId): each page resumes strictly
+    after the last row of the previous one, so deep pages cost the same
+    as the first and no cursor stays open between pages.
+    """
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(DB_FILE)
+    cur = conn.cursor()
+
+    category, category_params = _category_sql(category_version)
+
+    since = history_start(conn, user_id, days)
+    last = None
+
+    try:
+        while True:
+            if last is None:
+                cur.execute(
+                    f"""
+                    SELECT amount, txnType, {category}, merchant, narration, valueDate, valueTs, txnId
+                    FROM transactions
+                    WHERE userId = ? AND valueTs >= ?
+                    ORDER BY valueTs DESC, txnId DESC
+                    LIMIT ?
+                    """,
+                    category_params + [user_id, since, page_size],
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT amount, txnType, {category}, merchant, narration, valueDate, valueTs, txnId
+                    FROM transactions
+                    WHERE userId = ? AND valueTs >= ?
+                      AND (valueTs < ? OR (valueTs = ? AND txnId < ?))
+                    ORDER BY valueTs DESC, txnId DESC
+                    LIMIT ?
+                    """,
+                    category_params + [user_id, since, last[0], last[0], last[1], page_size],
+                )
+
+            rows = cur.fetchall()
+            if not rows:
+                return
+
+            yield [_row_to_txn(*row[:6]) for row in rows]
+
+            if len(rows) < page_size:
+                return
+            last = (rows[-1][6], rows[-1][7])
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def iter_history(
+    user_id: str,
+    days: Optional[float] = None,
+    max_txns: Optional[int] = None,
+    page_size: int = 500,
+    conn: Optional[sqlite3.Connection] = None,
+    category_version: Optional[str] = None,
+) -> Iterator[Txn]:
+    """
+    Streams a user's transactions newest first (see iter_transaction_pages),
+    stopping after `max_txns` when given.
+    """
+    pages = iter_transaction_pages(user_id, days, page_size, conn, category_version)
+    txns = (t for page in pages for t in page)
+    return islice(txns, max_txns) if max_txns else txns
+
+
+def load_history(
+    user_id: str,
+    days: Optional[float] = None,
+    max_txns: Optional[int] = None,
+    category_version: Optional[str] = None
+) -> List[Txn]:
+    """The whole windowed history as a list, for the list-based analytics."""
+    return list(iter_history(user_id, days, max_txns, category_version=category_version))
+
+
+def iter_user_histories(
+    user_ids: List[str],
+    days: Optional[float] = None,
+    max_txns: Optional[int] = None,
+    page_size: int = 500,
+    category_version: Optional[str] = None,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Iterator[Tuple[str, List[Txn]]]:
+    """
+    Windowed counterpart of iter_user_transactions: one connection for
+    all users (`conn`, left open, when given), one user's history in
+    memory at a time. Users without transactions in the window are not
+    yielded.
+    """
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(DB_FILE)
+
+    try:
+        for user_id in user_ids:
+            txns = list(iter_history(user_id, days, max_txns, page_size, conn, category_version))
+            if txns:
+                yield user_id, txns
+    finally:
+        if own_conn:
+            conn.close()
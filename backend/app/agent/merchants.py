@@ -0,0 +1,326 @@
+import difflib
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# MERCHANT CANONICALIZATION
+# ------------------------------------------------------------
+#
+# AA feeds spell one merchant many ways ("NETFLIX", "NETFLIX.COM",
+# "NETFLIX INDIA BILLDESK"). Each raw merchant string is mapped to a
+# canonical name (the matching key) in two steps:
+#
+#   1. normalize: upper-case, drop domain fragments ("WWW.", ".COM"),
+#      split on punctuation, then drop trailing payment-rail, gateway
+#      and legal-entity suffixes and reference numbers. Words inside
+#      the name are kept ("ONLINE", "INDIA", "DEBIT" can be brands);
+#   2. cluster: reuse an existing canonical name that is the same name
+#      with or without a trailing "INDIA", or a near-duplicate of it
+#      (difflib ratio >= MATCH_RATIO), else the normalized name becomes
+#      a new canonical.
+#
+# Step 2 only compares against canonicals sharing character trigrams
+# with the name (a blocking index), and only the few sharing the most,
+# so resolving a merchant stays near-constant time as the catalog grows.
+#
+# Mappings are persisted in merchant_canonical at ingest, so every
+# process (and every later run) agrees on them. Only the write path
+# (canonicalize) touches the in-memory index. Read paths load the
+# mapping once per user with load_merchants and hand it to the
+# analytics, which fall back to the normalized name without one.
+#
+# The key is never shown: users see the display name, the most common
+# raw spelling of the merchant (merchant_canonical.seen counts debits
+# per raw spelling).
+
+# Stripped only at the end of a name, repeatedly ("NETFLIX PVT LTD")
+SUFFIX_TOKENS = frozenset({
+    # legal entity
+    "PVT", "PRIVATE", "LTD", "LIMITED", "LLP", "INC", "CORP",
+    # payment gateways and rails
+    "BILLDESK", "RAZORPAY", "PAYU", "CCAVENUE", "CASHFREE",
+    "UPI", "IMPS", "NEFT", "RTGS", "POS", "ECOM", "NACH",
+    "AUTOPAY", "MANDATE", "REF", "TXN",
+})
+
+# Trailing region words a merchant may or may not carry ("NETFLIX INDIA")
+REGIONAL_TOKENS = ("INDIA",)
+
+# Minimum difflib ratio for two normalized names to be one merchant
+MATCH_RATIO = 0.85
+
+# Shorter names only ever match exactly ("OLA" vs "OYO")
+MIN_FUZZY_LENGTH = 5
+
+# Trigrams shared by more canonicals than this are too common to block on
+MAX_POSTING = 500
+
+# Candidates (most shared trigrams first) verified with difflib
+MAX_CANDIDATES = 8
+
+_SEPARATORS = re.compile(r"[^A-Z0-9]+")
+
+# "HTTPS://", "WWW." and dotted top-level domains ("NETFLIX.COM", "X.CO.IN")
+_DOMAIN_FRAGMENTS = re.compile(r"HTTPS?://|\bWWW\.|\.(?:CO\.IN|COM|NET|ORG|IN)\b")
+
+# (canonical key, display name)
+Merchant = Tuple[str, str]
+
+
+def normalize_merchant(raw: Optional[str]) -> str:
+    """
+    "Netflix.com India - BillDesk" -> "NETFLIX INDIA". Falls back to
+    the upper-cased raw name when every token is noise.
+    """
+    upper = (raw or "").upper()
+    tokens = [token for token in _SEPARATORS.split(_DOMAIN_FRAGMENTS.sub(" ", upper)) if token]
+    while tokens and (tokens[-1] in SUFFIX_TOKENS or tokens[-1].isdigit()):
+        tokens.pop()
+    return " ".join(tokens) or upper.strip()
+
+
+def _regional_variants(name: str) -> List[str]:
+    """The name without its trailing region word, or with each one added."""
+    tokens = name.split(" ")
+    if tokens[-1] in REGIONAL_TOKENS:
+        base = " ".join(tokens[:-1])
+        return [base] if len(base) >= MIN_FUZZY_LENGTH else []
+    if len(name) < MIN_FUZZY_LENGTH:
+        return []
+    return [f"{name} {region}" for region in REGIONAL_TOKENS]
+
+
+def _display(raw: Optional[str], key: str) -> str:
+    return (raw or "").strip() or key
+
+
+def _trigrams(name: str) -> Set[str]:
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MerchantIndex:
+    """Canonical names plus a trigram blocking index over them."""
+
+    def __init__(self):
+        self.canonicals: Set[str] = set()
+        self.postings: Dict[str, List[str]] = {}
+
+    def add(self, canonical: str):
+        if canonical in self.canonicals:
+            return
+        self.canonicals.add(canonical)
+        for gram in _trigrams(canonical):
+            self.postings.setdefault(gram, []).append(canonical)
+
+    def match(self, name: str) -> Optional[str]:
+        """Existing canonical for a normalized name, if any."""
+        if name in self.canonicals:
+            return name
+        for variant in _regional_variants(name):
+            if variant in self.canonicals:
+                return variant
+        if len(name) < MIN_FUZZY_LENGTH:
+            return None
+
+        shared = Counter()
+        for gram in _trigrams(name):
+            posting = self.postings.get(gram)
+            if posting and len(posting) <= MAX_POSTING:
+                shared.update(posting)
+
+        # seq2 is analysed once and reused; the cheap upper bounds weed
+        # out most candidates before the full ratio()
+        matcher = difflib.SequenceMatcher(None, "", name)
+
+        best, best_ratio = None, MATCH_RATIO
+        for candidate, _ in shared.most_common(MAX_CANDIDATES):
+            if len(candidate) < MIN_FUZZY_LENGTH:
+                continue
+
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+
+            ratio = matcher.ratio()
+            if ratio >= best_ratio and (best is None or ratio > best_ratio):
+                best, best_ratio = candidate, ratio
+
+        return best
+
+    def resolve(self, raw: Optional[str]) -> str:
+        name = normalize_merchant(raw)
+        if not name:
+            return ""
+
+        canonical = self.match(name) or name
+        self.add(canonical)
+        return canonical
+
+
+# Process-wide state: the index mirrors merchant_canonical up to
+# _synced_rowid. Ingest runs in FastAPI's thread pool, so every use of
+# the index holds _index_lock.
+_index = MerchantIndex()
+_synced_rowid = 0
+_index_lock = threading.Lock()
+
+
+def _sync_index(cur: sqlite3.Cursor):
+    """Adds canonicals stored (by any process) since the last sync."""
+    global _synced_rowid
+
+    for rowid, canonical in cur.execute(
+        "SELECT rowid, canonical FROM merchant_canonical WHERE rowid > ? ORDER BY rowid",
+        (_synced_rowid,),
+    ).fetchall():
+        _index.add(canonical)
+        _synced_rowid = rowid
+
+
+def _lookup(cur: sqlite3.Cursor, raws: List[str], chunk_size: int = 500) -> Dict[str, str]:
+    stored = {}
+    for i in range(0, len(raws), chunk_size):
+        chunk = raws[i:i + chunk_size]
+        placeholders = ",".join("?" for _ in chunk)
+        stored.update(cur.execute(
+            f"SELECT raw, canonical FROM merchant_canonical WHERE raw IN ({placeholders})",
+            chunk,
+        ).fetchall())
+    return stored
+
+
+def canonicalize(raws: Iterable[Optional[str]], cur: sqlite3.Cursor) -> Dict[str, str]:
+    """
+    Maps raw merchant strings to canonical names (None is treated as "").
+    Unknown merchants are resolved and stored in the caller's transaction.
+    """
+    requested = set(raws)
+    misses = sorted({raw or "" for raw in requested})
+
+    stored = _lookup(cur, misses)
+
+    with _index_lock:
+        _sync_index(cur)
+        new = {raw: _index.resolve(raw) for raw in misses if raw not in stored}
+
+    if new:
+        cur.executemany(
+            "INSERT OR IGNORE INTO merchant_canonical (raw, canonical) VALUES (?, ?)",
+            list(new.items()),
+        )
+
+    resolved = {**stored, **new}
+    return {raw: resolved[raw or ""] for raw in requested}
+
+
+def record_merchants(cur: sqlite3.Cursor, raws: List[Optional[str]]):
+    """
+    canonicalize() for newly stored debits that also counts each raw
+    spelling towards the display name, in the caller's transaction.
+    """
+    canonicalize(raws, cur)
+    cur.executemany(
+        "UPDATE merchant_canonical SET seen = seen + ? WHERE raw = ?",
+        [(count, raw) for raw, count in Counter(raw or "" for raw in raws).items()],
+    )
+
+
+def rebuild_merchant_canonical(cur: sqlite3.Cursor):
+    """
+    Resolves every stored debit merchant from scratch with the current
+    normalization, together with its debit count, in the caller's
+    transaction. State keyed by canonical name must be rebuilt after.
+    """
+    global _index, _synced_rowid
+
+    counts = cur.execute("""
+        SELECT COALESCE(merchant, ''), COUNT(*)
+        FROM transactions
+        WHERE txnType = 'DEBIT'
+        GROUP BY COALESCE(merchant, '')
+        ORDER BY 1
+    """).fetchall()
+
+    index = MerchantIndex()
+    cur.execute("DELETE FROM merchant_canonical")
+    cur.executemany(
+        "INSERT INTO merchant_canonical (raw, canonical, seen) VALUES (?, ?, ?)",
+        [(raw, index.resolve(raw), seen) for raw, seen in counts],
+    )
+
+    # Reloaded from the table by the next canonicalize()
+    with _index_lock:
+        _index = MerchantIndex()
+        _synced_rowid = 0
+
+
+def merchant_displays(cur: sqlite3.Cursor, keys: Iterable[str], chunk_size: int = 500) -> Dict[str, str]:
+    """Display name per canonical key: its most common raw spelling."""
+    keys = sorted(set(keys))
+    displays = {}
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        placeholders = ",".join("?" for _ in chunk)
+        for canonical, raw in cur.execute(f"""
+            SELECT canonical, raw FROM merchant_canonical
+            WHERE canonical IN ({placeholders})
+            ORDER BY canonical, seen DESC, raw
+        """, chunk):
+            displays.setdefault(canonical, _display(raw, canonical))
+    return displays
+
+
+def load_merchants(
+    raws: Iterable[Optional[str]],
+    db_path: str = FIU_DB,
+    conn: Optional[sqlite3.Connection] = None
+) -> Dict[Optional[str], Merchant]:
+    """
+    Read-only raw -> (key, display) mapping for the analytics, covering
+    the merchants stored so far. Reads through `conn` when given.
+    """
+    requested = set(raws)
+
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        stored = _lookup(cur, sorted({raw or "" for raw in requested}))
+        displays = merchant_displays(cur, stored.values())
+    finally:
+        if own_conn:
+            conn.close()
+
+    return {
+        raw: (stored[raw or ""], displays[stored[raw or ""]])
+        for raw in requested if (raw or "") in stored
+    }
+
+
+def merchant_names(
+    raws: Iterable[Optional[str]],
+    merchants: Optional[Dict[Optional[str], Merchant]] = None
+) -> Dict[Optional[str], Merchant]:
+    """
+    raw -> (key, display) from a load_merchants mapping. Merchants it
+    lacks are keyed by normalized name and displayed as their most
+    common spelling among `raws`.
+    """
+    merchants = merchants or {}
+    counts = Counter(raws)
+
+    keys = {raw: normalize_merchant(raw) for raw in counts if raw not in merchants}
+    displays = {}
+    for raw, _ in counts.most_common():
+        if raw in keys:
+            displays.setdefault(keys[raw], _display(raw, keys[raw]))
+
+    names = {raw: (key, displays[key]) for raw, key in keys.items()}
+    names.update((raw, merchants[raw]) for raw in counts if raw in merchants)
+    return names
@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# STAGE METRICS
+# ------------------------------------------------------------
+#
+# Count and total are exact; percentiles come from a rolling window of
+# the most recent samples per stage, so memory stays bounded.
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class StageMetrics:
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._count: Dict[str, int] = {}
+        self._total: Dict[str, float] = {}
+        self._recent: Dict[str, deque] = {}
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._count[stage] = self._count.get(stage, 0) + 1
+            self._total[stage] = self._total.get(stage, 0.0) + seconds
+            self._recent.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    # --- cross-process hand-off (worker → parent) ---
+
+    def reset(self):
+        with self._lock:
+            self._count.clear()
+            self._total.clear()
+            self._recent.clear()
+            self.last_run = None
+
+    def export(self) -> Dict[str, Dict[str, Any]]:
+        """Picklable copy of the raw per-stage state."""
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "total": self._total[stage],
+                    "recent": list(self._recent[stage]),
+                }
+                for stage, count in self._count.items()
+            }
+
+    def merge(self, exported: Dict[str, Dict[str, Any]]):
+        """Folds another process's export() into this instance."""
+        with self._lock:
+            for stage, data in exported.items():
+                self._count[stage] = self._count.get(stage, 0) + data["count"]
+                self._total[stage] = self._total.get(stage, 0.0) + data["total"]
+                self._recent.setdefault(stage, deque(maxlen=self.window)).extend(data["recent"])
+
+    # --- reporting ---
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for stage, count in self._count.items():
+                recent = sorted(self._recent[stage])
+                stages[stage] = {
+                    "count": count,
+                    "total_ms": round(self._total[stage] * 1000, 3),
+                    "p50_ms": round(_percentile(recent, 50) * 1000, 3),
+                    "p95_ms": round(_percentile(recent, 95) * 1000, 3),
+                    "p99_ms": round(_percentile(recent, 99) * 1000, 3),
+                }
+
+            return {
+                "stages": stages,
+                "last_run": self.last_run,
+            }
+
+
+# Process-wide metrics for the agent pipeline
+agent_metrics = StageMetrics()
+
+
+# ------------------------------------------------------------
+# SHARED SNAPSHOT (agent worker process → API processes)
+# ------------------------------------------------------------
+
+def init_metrics_table(cur: sqlite3.Cursor):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS agent_metrics (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            updatedAt TEXT,
+            snapshotJson TEXT
+        );
+    """)
+
+
+def save_snapshot(metrics: StageMetrics = agent_metrics):
+    """Publishes this process's metrics for API processes to serve."""
+    conn = sqlite3.connect(FIU_DB)
+    conn.execute("""
+        INSERT INTO agent_metrics (id, updatedAt, snapshotJson)
+        VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            updatedAt = excluded.updatedAt,
+            snapshotJson = excluded.snapshotJson;
+    """, (time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), json.dumps(metrics.snapshot())))
+    conn.commit()
+    conn.close()
+
+
+def load_snapshot() -> Optional[Dict[str, Any]]:
+    """Latest snapshot published by the agent worker, if any."""
+    conn = sqlite3.connect(FIU_DB)
+    try:
+        row = conn.execute("SELECT updatedAt, snapshotJson FROM agent_metrics WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # table not created yet (no worker has run)
+    finally:
+        conn.close()
+
+    if not row:
+        return None
+
+    snapshot = json.loads(row[1])
+    snapshot["published_at"] = row[0]
+    return snapshot
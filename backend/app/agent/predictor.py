@@ -2,11 +2,13 @@ from datetime import datetime
 from typing import List, Dict, Any
 import statistics
 
+from app.agent.loader import Txn
+
 # ------------------------------------------------------------
 # HELPER: Group transactions by month
 # ------------------------------------------------------------
 
-def _group_by_month(txns: List[Dict[str, Any]]) -> Dict[str, float]:
+def _group_by_month(txns: List[Txn]) -> Dict[str, float]:
     """
     Returns:
     {
@@ -18,13 +20,13 @@ def _group_by_month(txns: List[Dict[str, Any]]) -> Dict[str, float]:
     monthly = {}
 
     for t in txns:
-        if t["type"] != "DEBIT":
+        if t.type != "DEBIT":
             continue
 
-        dt = t["date"]
+        dt = t.date
         key = f"{dt.year}-{dt.month:02d}"
 
-        monthly[key] = monthly.get(key, 0) + t["amount"]
+        monthly[key] = monthly.get(key, 0) + t.amount
 
     return monthly
 
@@ -65,7 +67,7 @@ def _predict_next_value(values: List[float]) -> float:
 # CATEGORY-LEVEL TREND PREDICTION
 # ------------------------------------------------------------
 
-def _predict_category(txns: List[Dict[str, Any]]) -> Dict[str, float]:
+def _predict_category(txns: List[Txn]) -> Dict[str, float]:
     """
     Predict spend per category for next month.
     """
@@ -75,15 +77,15 @@ def _predict_category(txns: List[Dict[str, Any]]) -> Dict[str, float]:
     monthly_cat = {}
 
     for t in txns:
-        if t["type"] != "DEBIT":
+        if t.type != "DEBIT":
             continue
 
-        dt = t["date"]
+        dt = t.date
         key = f"{dt.year}-{dt.month:02d}"
 
-        cat = t["category"]
+        cat = t.category
         monthly_cat.setdefault(cat, {})
-        monthly_cat[cat][key] = monthly_cat[cat].get(key, 0) + t["amount"]
+        monthly_cat[cat][key] = monthly_cat[cat].get(key, 0) + t.amount
 
     # Predict per category
     for cat, monthly_data in monthly_cat.items():
@@ -98,7 +100,7 @@ def _predict_category(txns: List[Dict[str, Any]]) -> Dict[str, float]:
 # PUBLIC API: PREDICT FUTURE SPENDING
 # ------------------------------------------------------------
 
-def predict_future(txns: List[Dict[str, Any]]) -> Dict[str, Any]:
+def predict_future(txns: List[Txn]) -> Dict[str, Any]:
     """
     Predicts:
     - next month's total spending
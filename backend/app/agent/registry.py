@@ -0,0 +1,187 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# USERS REGISTRY
+# ------------------------------------------------------------
+#
+# One row per synced user with two watermarks:
+#   lastIngestedAt  — bumped by the FIU sync whenever new rows land
+#   lastProcessedAt — bumped by the agent after it recomputes insights
+# plus lastViewedAt (insights requested via the API), which the
+# scheduler uses to keep active users fresh first.
+#
+# A user is "dirty" when it has never been processed or when new data
+# arrived after the last processing run.
+
+def _now_watermark() -> str:
+    # Fixed-width timestamps so watermarks compare correctly as TEXT
+    return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+
+def init_registry(cur: sqlite3.Cursor):
+    """
+    Creates the users registry and registers any user that already has
+    transactions (existing users start out dirty).
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            userId TEXT PRIMARY KEY,
+            lastIngestedAt TEXT,
+            lastProcessedAt TEXT,
+            lastViewedAt TEXT
+        );
+    """)
+
+    # Registries created before lastViewedAt existed
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(users)")}
+    if "lastViewedAt" not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN lastViewedAt TEXT")
+
+    cur.execute("""
+        INSERT OR IGNORE INTO users (userId, lastIngestedAt, lastProcessedAt)
+        SELECT DISTINCT userId, ?, NULL FROM transactions
+    """, (_now_watermark(),))
+
+
+def mark_ingested(cur: sqlite3.Cursor, user_id: str):
+    """
+    Flags a user as having new data. Runs on the caller's cursor so it
+    commits together with the inserted transactions.
+    """
+    cur.execute("""
+        INSERT INTO users (userId, lastIngestedAt, lastProcessedAt)
+        VALUES (?, ?, NULL)
+        ON CONFLICT(userId) DO UPDATE SET
+            lastIngestedAt = excluded.lastIngestedAt;
+    """, (user_id, _now_watermark()))
+
+
+def mark_stale(cur: sqlite3.Cursor, user_id: str):
+    """
+    Flags a user for reprocessing without new data (e.g. recategorized
+    history). lastProcessedAt is moved back to just before lastIngestedAt,
+    so the scheduler doesn't rank the user as freshly synced. Runs on the
+    caller's cursor.
+    """
+    row = cur.execute(
+        "SELECT lastIngestedAt, lastProcessedAt FROM users WHERE userId = ?",
+        (user_id,),
+    ).fetchone()
+    if not row or not row[0] or not row[1] or row[0] > row[1]:
+        return  # unknown or already dirty
+
+    ingested = datetime.fromisoformat(row[0].rstrip("Z"))
+    cur.execute(
+        "UPDATE users SET lastProcessedAt = ? WHERE userId = ?",
+        ((ingested - timedelta(microseconds=1)).isoformat(timespec="microseconds") + "Z", user_id),
+    )
+
+
+# Views are frequent; write at most once per user per interval
+VIEW_DEBOUNCE_SECONDS = 60.0
+
+# Expired debounce entries are dropped once this many users are tracked
+VIEW_DEBOUNCE_MAX_USERS = 10000
+_view_written = {}
+
+
+def mark_viewed(user_id: str):
+    """
+    Records that a user's insights were just requested. Called from the
+    API read path, so writes are debounced per process and best-effort:
+    a locked or unavailable DB only costs the scheduler a ranking hint.
+    """
+    now = time.monotonic()
+    last = _view_written.get(user_id)
+    if last is not None and now - last < VIEW_DEBOUNCE_SECONDS:
+        return
+
+    if len(_view_written) >= VIEW_DEBOUNCE_MAX_USERS:
+        for viewed, at in list(_view_written.items()):
+            if now - at >= VIEW_DEBOUNCE_SECONDS:
+                del _view_written[viewed]
+        if len(_view_written) >= VIEW_DEBOUNCE_MAX_USERS:
+            _view_written.clear()
+    _view_written[user_id] = now
+
+    conn = sqlite3.connect(FIU_DB)
+    try:
+        conn.execute(
+            "UPDATE users SET lastViewedAt = ? WHERE userId = ?",
+            (_now_watermark(), user_id),
+        )
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        print(f"[AGENT] Could not record view for {user_id}: {e}")
+    finally:
+        conn.close()
+
+
+# ------------------------------------------------------------
+# AGENT SIDE
+# ------------------------------------------------------------
+
+def start_watermark() -> str:
+    """
+    Watermark to record for a run. Taken *before* the dirty users are read,
+    so data ingested while the run is in progress keeps the user dirty.
+    """
+    return _now_watermark()
+
+
+def load_dirty_users() -> List[str]:
+    """
+    Returns userIds whose data changed since they were last processed.
+    """
+    conn = sqlite3.connect(FIU_DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT userId FROM users
+        WHERE lastProcessedAt IS NULL
+           OR lastIngestedAt > lastProcessedAt
+    """)
+    users = [row[0] for row in cur.fetchall()]
+
+    conn.close()
+    return users
+
+
+def load_dirty_rows() -> List[Tuple[str, str, Optional[str], Optional[str]]]:
+    """
+    Like load_dirty_users, but with the watermarks the scheduler ranks
+    on: (userId, lastIngestedAt, lastProcessedAt, lastViewedAt).
+    """
+    conn = sqlite3.connect(FIU_DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT userId, lastIngestedAt, lastProcessedAt, lastViewedAt FROM users
+        WHERE lastProcessedAt IS NULL
+           OR lastIngestedAt > lastProcessedAt
+    """)
+    rows = cur.fetchall()
+
+    conn.close()
+    return rows
+
+
+def mark_processed(cur: sqlite3.Cursor, user_ids: List[str], watermark: Optional[str] = None):
+    """
+    Records that the given users were processed as of `watermark`.
+    Runs on the caller's cursor so it commits together with the insights.
+    """
+    if not user_ids:
+        return
+
+    watermark = watermark or _now_watermark()
+
+    cur.executemany(
+        "UPDATE users SET lastProcessedAt = ? WHERE userId = ?",
+        [(watermark, user_id) for user_id in user_ids],
+    )
@@ -0,0 +1,119 @@
+import heapq
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.agent.registry import load_dirty_rows
+from app.agent_config import (
+    AGENT_SHARD_SIZE,
+    AGENT_POLL_SECONDS,
+    AGENT_POLL_MAX_SECONDS,
+    AGENT_CYCLE_BUDGET_SECONDS,
+    AGENT_ACTIVE_SECONDS,
+)
+
+# ------------------------------------------------------------
+# STALENESS-PRIORITY SCHEDULER
+# ------------------------------------------------------------
+#
+# Each cycle ranks dirty users by how long their insights have been
+# stale, boosted when the user was recently viewed or synced, and picks
+# as many as fit the cycle's time budget (estimated from the measured
+# per-user cost). The cycle interval shrinks while there is a backlog and
+# stretches while idle.
+
+# Priority multipliers for recent activity
+VIEW_BOOST = 4.0
+SYNC_BOOST = 2.0
+
+# Never-processed users have no insights at all; rank them ahead of
+# users that have been stale for as long
+NEVER_PROCESSED_BOOST = 2.0
+
+# Weight of the newest run in the per-user cost estimate
+COST_SMOOTHING = 0.3
+
+
+def _parse_watermark(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.rstrip("Z")) if value else None
+
+
+def priority(
+    row: Tuple[str, str, Optional[str], Optional[str]],
+    now: datetime,
+    active_seconds: float = AGENT_ACTIVE_SECONDS
+) -> float:
+    """
+    Higher is more urgent. Base score is seconds since the data went
+    stale (last processing, or first ingest for never-processed users).
+    """
+    ingested, processed, viewed = map(_parse_watermark, row[1:])
+
+    stale_since = processed or ingested or now
+    score = max((now - stale_since).total_seconds(), 1.0)
+
+    if processed is None:
+        score *= NEVER_PROCESSED_BOOST
+    if viewed and (now - viewed).total_seconds() <= active_seconds:
+        score *= VIEW_BOOST
+    if ingested and (now - ingested).total_seconds() <= active_seconds:
+        score *= SYNC_BOOST
+
+    return score
+
+
+class AgentScheduler:
+    def __init__(
+        self,
+        budget_seconds: float = AGENT_CYCLE_BUDGET_SECONDS,
+        min_interval: float = AGENT_POLL_SECONDS,
+        max_interval: float = AGENT_POLL_MAX_SECONDS
+    ):
+        self.budget_seconds = budget_seconds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.interval = min_interval
+        self.per_user_seconds = None  # unknown until the first run
+        self.backlog = 0
+
+    def capacity(self) -> int:
+        """How many users are expected to fit in one cycle's budget."""
+        if not self.per_user_seconds:
+            return AGENT_SHARD_SIZE
+        return max(1, int(self.budget_seconds / self.per_user_seconds))
+
+    def next_users(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        Most urgent dirty users that fit this cycle, most urgent first.
+        Whatever is left over is counted as backlog.
+        """
+        now = now or datetime.utcnow()
+        rows = load_dirty_rows()
+
+        take = self.capacity()
+        ranked = heapq.nlargest(take, rows, key=lambda row: priority(row, now))
+
+        self.backlog = len(rows) - len(ranked)
+        return [row[0] for row in ranked]
+
+    def record(self, stats: Dict[str, Any]):
+        """Feeds a finished run back into the per-user cost estimate."""
+        if not stats.get("users"):
+            return
+
+        cost = stats["seconds"] / stats["users"]
+        if self.per_user_seconds is None:
+            self.per_user_seconds = cost
+        else:
+            self.per_user_seconds += COST_SMOOTHING * (cost - self.per_user_seconds)
+
+    def next_interval(self, processed: int) -> float:
+        """
+        Seconds to sleep before the next cycle: back to the minimum while
+        there is work, doubling up to the maximum while idle.
+        """
+        if self.backlog or processed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self.interval
@@ -1,7 +1,15 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from fractions import Fraction
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import sqlite3
 import statistics
 
+from app.agent.catalog import in_band, load_catalog
+from app.agent.cycles import NEXT_PAYMENT_DAYS, cycle_from_gaps
+from app.agent.loader import Txn, history_start
+from app.agent.merchants import Merchant, canonicalize, merchant_displays, merchant_names
+from app.db_config import FIU_DB
+
 # ------------------------------------------------------------
 # HELPER: Check if two amounts are "similar"
 # ------------------------------------------------------------
@@ -32,62 +40,75 @@ def _detect_cycle(dates: List[datetime]) -> str:
         diff = (dates[i] - dates[i-1]).days
         gaps.append(diff)
 
-    avg_gap = statistics.mean(gaps)
-
-    if 26 <= avg_gap <= 34:
-        return "Monthly"
-    if 85 <= avg_gap <= 95:
-        return "Quarterly"
-    if 350 <= avg_gap <= 380:
-        return "Yearly"
-
-    return "Unknown"
+    return cycle_from_gaps(sum(gaps), len(gaps))
 
 
 # ------------------------------------------------------------
 # MAIN LOGIC: DETECT SUBSCRIPTION GROUPS
 # ------------------------------------------------------------
 
-def detect_subscriptions(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def detect_subscriptions(
+    txns: List[Txn],
+    merchants: Optional[Dict[Optional[str], Merchant]] = None
+) -> List[Dict[str, Any]]:
     """
     Detect recurring transactions by grouping merchants with repeated,
-    similar amounts spaced consistently over time.
+    similar amounts spaced consistently over time. Merchants are grouped
+    by canonical key (from `merchants`, a load_merchants mapping, or
+    normalized), so spelling variants land in one group reported under
+    its display name.
+
+    The shared catalog is a fast path: recurring merchants paid within
+    their price band take the catalog cycle from the first payment,
+    other amounts fall back to cycle inference; non-recurring merchants
+    are never subscriptions.
     """
     subscriptions = []
+    catalog = load_catalog()
 
-    # STEP 1 — group by merchant
-    merchant_groups = {}
-    for t in txns:
-        if t["type"] != "DEBIT":
-            continue
+    # STEP 1 — group by canonical merchant
+    debits = [t for t in txns if t.type == "DEBIT"]
+    names = merchant_names((t.merchant for t in debits), merchants)
 
-        m = t["merchant"].upper().strip()
+    merchant_groups = {}
+    displays = {}
+    for t in debits:
+        m, display = names[t.merchant]
         if not m:
             continue
 
         merchant_groups.setdefault(m, []).append(t)
+        displays[m] = display
 
     # STEP 2 — analyze each merchant
     for merchant, group in merchant_groups.items():
-        if len(group) < 2:
+        known = catalog.get(merchant)
+        if known and not known[0]:
+            continue  # Known non-recurring merchant
+        if not known and len(group) < 2:
             continue  # Not enough occurrences to be a subscription
 
         # Sort by date
-        group = sorted(group, key=lambda x: x["date"])
+        group = sorted(group, key=lambda x: x.date)
 
         # Extract amounts and dates
-        amounts = [t["amount"] for t in group]
-        dates = [t["date"] for t in group]
+        amounts = [t.amount for t in group]
+        dates = [t.date for t in group]
 
         # STEP 3 — check amount similarity
         similar_amounts = all(_amount_similar(amounts[i], amounts[i-1]) for i in range(1, len(amounts)))
         if not similar_amounts:
             continue
 
-        # STEP 4 — detect cycle type
-        cycle = _detect_cycle(dates)
-        if cycle == "Unknown":
-            continue
+        mean_amount = statistics.mean(amounts)
+
+        # STEP 4 — detect cycle type (catalog merchants in band: known cycle)
+        if known and in_band(known, mean_amount):
+            cycle = known[1]
+        else:
+            cycle = _detect_cycle(dates)  # "Unknown" for a single payment
+            if cycle == "Unknown":
+                continue
 
         last_payment = dates[-1]
 
@@ -102,8 +123,8 @@ def detect_subscriptions(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             next_date = None
 
         subscriptions.append({
-            "merchant": merchant,
-            "amount": round(statistics.mean(amounts), 2),
+            "merchant": displays[merchant],
+            "amount": round(mean_amount, 2),
             "cycle": cycle,
             "last_payment": last_payment.isoformat(),
             "next_payment": next_date.isoformat() if next_date else None,
@@ -111,3 +132,257 @@ def detect_subscriptions(txns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         })
 
     return subscriptions
+
+
+# ------------------------------------------------------------
+# PERSISTED PER-MERCHANT STATE
+# ------------------------------------------------------------
+#
+# subscription_state keeps, per (user, canonical merchant), the running totals
+# detect_subscriptions derives from a full scan: payment count, last
+# payment, exact amount sum, summed day gaps and whether every amount so
+# far was similar to the previous one. save_fi_data advances them in
+# O(1) per new debit, and load_subscriptions turns them into the same
+# records detect_subscriptions would return for the user's whole history.
+#
+# A debit older than the merchant's last payment can't be applied
+# incrementally; the row is flagged, and the agent's main process
+# rebuilds flagged users from the transactions table (under its lease)
+# before handing them to workers, which only ever read the state.
+
+DAY_US = 86_400_000_000
+EPOCH = datetime(1970, 1, 1)
+
+# (merchant key, count, lastTs, lastAmount, amountSum, gapDaysSum, similar, needsRebuild)
+State = List[Any]
+
+
+def _new_state(merchant: str, ts: int, amount: float) -> State:
+    return [merchant, 1, ts, amount, Fraction(amount), 0, 1, 0]
+
+
+def _advance(state: State, ts: int, amount: float):
+    """Applies one debit no older than the merchant's last payment."""
+    _, count, last_ts, last_amount, amount_sum, gap_days, similar, _ = state
+
+    # Whole days between payments, as (date - date).days counts them
+    state[1] = count + 1
+    state[2] = ts
+    state[3] = amount
+    state[4] = amount_sum + Fraction(amount)
+    state[5] = gap_days + (ts - last_ts) // DAY_US
+    state[6] = int(bool(similar) and _amount_similar(amount, last_amount))
+
+
+def _build_states(
+    debits: List[Tuple[Optional[str], int, float]],
+    names: Dict[Optional[str], str]
+) -> Dict[str, State]:
+    """States from scratch for (merchant, valueTs, amount) rows in valueTs order."""
+    states = {}
+    for merchant, ts, amount in debits:
+        key = names[merchant]
+        if not key or ts is None:
+            continue
+
+        state = states.get(key)
+        if state is None:
+            states[key] = _new_state(key, ts, amount)
+        else:
+            _advance(state, ts, amount)
+
+    return states
+
+
+def _save_states(cur: sqlite3.Cursor, user_id: str, states: Iterable[State]):
+    cur.executemany("""
+        INSERT INTO subscription_state
+            (userId, merchant, count, lastTs, lastAmount, amountSum,
+             gapDaysSum, similar, needsRebuild)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(userId, merchant) DO UPDATE SET
+            count = excluded.count,
+            lastTs = excluded.lastTs,
+            lastAmount = excluded.lastAmount,
+            amountSum = excluded.amountSum,
+            gapDaysSum = excluded.gapDaysSum,
+            similar = excluded.similar,
+            needsRebuild = excluded.needsRebuild;
+    """, [
+        (user_id, key, count, ts, last_amount, str(amount_sum), gap_days, similar, rebuild)
+        for key, count, ts, last_amount, amount_sum, gap_days, similar, rebuild in states
+    ])
+
+
+def rebuild_subscription_state(cur: sqlite3.Cursor, user_id: str):
+    """Recomputes every merchant state of a user from stored debits."""
+    rows = cur.execute("""
+        SELECT merchant, valueTs, amount
+        FROM transactions
+        WHERE userId = ? AND txnType = 'DEBIT'
+        ORDER BY valueTs
+    """, (user_id,)).fetchall()
+
+    names = canonicalize((row[0] for row in rows), cur)
+
+    cur.execute("DELETE FROM subscription_state WHERE userId = ?", (user_id,))
+    _save_states(cur, user_id, _build_states(rows, names).values())
+
+
+def rebuild_all_subscription_state(cur: sqlite3.Cursor):
+    user_ids = [row[0] for row in cur.execute("SELECT DISTINCT userId FROM transactions")]
+    for user_id in user_ids:
+        rebuild_subscription_state(cur, user_id)
+
+
+def apply_debits(cur: sqlite3.Cursor, user_id: str, debits: List[Tuple[Optional[str], int, float]]):
+    """
+    Advances the user's merchant states with newly stored
+    (merchant, valueTs, amount) debits, in the caller's transaction.
+    """
+    names = canonicalize((debit[0] for debit in debits), cur)
+
+    by_merchant: Dict[str, List[Tuple[int, float]]] = {}
+    for merchant, ts, amount in debits:
+        key = names[merchant]
+        if key and ts is not None:
+            by_merchant.setdefault(key, []).append((ts, amount))
+
+    if not by_merchant:
+        return
+
+    keys = list(by_merchant)
+    placeholders = ",".join("?" for _ in keys)
+    states = {
+        row[0]: [row[0], row[1], row[2], row[3], Fraction(row[4]), row[5], row[6], row[7]]
+        for row in cur.execute(f"""
+            SELECT merchant, count, lastTs, lastAmount, amountSum,
+                   gapDaysSum, similar, needsRebuild
+            FROM subscription_state
+            WHERE userId = ? AND merchant IN ({placeholders})
+        """, (user_id, *keys))
+    }
+
+    for key, payments in by_merchant.items():
+        payments.sort(key=lambda p: p[0])
+        state = states.get(key)
+
+        for ts, amount in payments:
+            if state is None:
+                state = states[key] = _new_state(key, ts, amount)
+            elif state[7]:
+                break  # already waiting for a rebuild
+            elif ts < state[2]:
+                state[7] = 1  # backdated payment, gaps must be recomputed
+                break
+            else:
+                _advance(state, ts, amount)
+
+    _save_states(cur, user_id, states.values())
+
+
+def _state_record(
+    merchant: str,
+    count: int,
+    last_ts: int,
+    amount_sum: str,
+    gap_days: int,
+    catalog: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Same rules as detect_subscriptions, applied to one merchant state."""
+    known = catalog.get(merchant)
+    mean_amount = float(Fraction(amount_sum) / count)
+
+    if known and not known[0]:
+        return None
+
+    if known and in_band(known, mean_amount):
+        cycle = known[1]
+    else:
+        cycle = cycle_from_gaps(gap_days, count - 1)
+        if cycle == "Unknown":
+            return None
+
+    last_payment = EPOCH + timedelta(microseconds=last_ts)
+    next_date = last_payment + timedelta(days=NEXT_PAYMENT_DAYS[cycle])
+
+    return {
+        "merchant": merchant,
+        "amount": round(mean_amount, 2),
+        "cycle": cycle,
+        "last_payment": last_payment.isoformat(),
+        "next_payment": next_date.isoformat(),
+        "confidence": 0.9
+    }
+
+
+def rebuild_flagged_states(user_ids: List[str], db_path: str = FIU_DB) -> int:
+    """
+    Rebuilds the subscription state of those `user_ids` that have a
+    flagged merchant, in one write transaction. Returns how many users
+    were rebuilt. Called by the agent's single writer before a run.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None  # explicit transaction below
+    cur = conn.cursor()
+
+    try:
+        flagged = {row[0] for row in cur.execute(
+            "SELECT DISTINCT userId FROM subscription_state WHERE needsRebuild = 1"
+        )}
+        users = [user_id for user_id in user_ids if user_id in flagged]
+        if not users:
+            return 0
+
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id in users:
+                rebuild_subscription_state(cur, user_id)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return len(users)
+
+
+def load_subscriptions(
+    user_id: str,
+    days: Optional[float] = None,
+    db_path: str = FIU_DB,
+    conn: Optional[sqlite3.Connection] = None
+) -> List[Dict[str, Any]]:
+    """
+    Subscriptions read from subscription_state, whose totals cover the
+    user's full stored history. Only merchants last paid within the same
+    window as the loaded history (see history_start) are reported, so
+    cancelled subscriptions drop out. Newest last payment first.
+    Read-only: flagged merchants are read as they are until
+    rebuild_flagged_states runs. Reads through `conn` when given.
+    """
+    own_conn = conn is None
+    conn = conn or sqlite3.connect(db_path)
+
+    try:
+        cur = conn.cursor()
+        rows = cur.execute("""
+            SELECT merchant, count, lastTs, amountSum, gapDaysSum
+            FROM subscription_state
+            WHERE userId = ? AND similar = 1 AND lastTs >= ?
+            ORDER BY lastTs DESC
+        """, (user_id, history_start(conn, user_id, days))).fetchall()
+
+        catalog = load_catalog(db_path)
+        records = [record for record in (_state_record(*row, catalog) for row in rows) if record]
+
+        # State is keyed by canonical key; report display names
+        displays = merchant_displays(cur, (record["merchant"] for record in records))
+    finally:
+        if own_conn:
+            conn.close()
+
+    for record in records:
+        record["merchant"] = displays.get(record["merchant"], record["merchant"])
+    return records
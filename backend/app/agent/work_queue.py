@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Set
+
+# ------------------------------------------------------------
+# IN-PROCESS AGENT WORK QUEUE
+# ------------------------------------------------------------
+
+class AgentWorkQueue:
+    """
+    Set-backed queue of userIds waiting for an agent run.
+    Repeated enqueues of the same user coalesce into one entry.
+    """
+
+    def __init__(self):
+        self._pending: Set[str] = set()
+        self._cond = threading.Condition()
+
+    def enqueue(self, user_id: str):
+        with self._cond:
+            self._pending.add(user_id)
+            self._cond.notify()
+
+    def drain(self) -> Set[str]:
+        """Takes everything queued right now (may be empty)."""
+        with self._cond:
+            users, self._pending = self._pending, set()
+        return users
+
+    def wait(self, timeout: float, coalesce_seconds: float = 0.0) -> Set[str]:
+        """
+        Blocks until at least one user is queued or `timeout` elapses.
+        Once woken, lingers `coalesce_seconds` so a burst of syncs is
+        handled as a single run. Returns an empty set on timeout.
+        """
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            if not self._pending:
+                return set()
+
+        if coalesce_seconds > 0:
+            time.sleep(coalesce_seconds)
+
+        return self.drain()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+
+# Process-wide queue shared by the sync endpoint and the agent thread
+work_queue = AgentWorkQueue()
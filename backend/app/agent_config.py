@@ -0,0 +1,67 @@
+import os
+
+# ------------------------------------------------------------
+# AGENT CONFIG — every value can be overridden via env vars
+# ------------------------------------------------------------
+
+# Worker processes for the per-user pipeline (1 = serial, in-process)
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", "1"))
+
+# Users handed to a worker process per task
+AGENT_SHARD_SIZE = int(os.environ.get("AGENT_SHARD_SIZE", "50"))
+
+# Buffered insights writer: flush after this many users...
+INSIGHTS_BATCH_SIZE = int(os.environ.get("INSIGHTS_BATCH_SIZE", "500"))
+
+# ...or once the oldest buffered result is this old (seconds)
+INSIGHTS_FLUSH_SECONDS = float(os.environ.get("INSIGHTS_FLUSH_SECONDS", "2.0"))
+
+# Safety-net sweep over all dirty users when no syncs arrive (seconds)
+AGENT_SWEEP_SECONDS = float(os.environ.get("AGENT_SWEEP_SECONDS", "300"))
+
+# How long the agent lingers after a sync to coalesce a burst (seconds)
+AGENT_COALESCE_SECONDS = float(os.environ.get("AGENT_COALESCE_SECONDS", "0.5"))
+
+# History the analytics see per user: the AGENT_HISTORY_DAYS days up to
+# their newest transaction, at most AGENT_HISTORY_MAX_TXNS rows.
+# 0 days = legacy 200 most recent rows.
+AGENT_HISTORY_DAYS = float(os.environ.get("AGENT_HISTORY_DAYS", "180"))
+AGENT_HISTORY_MAX_TXNS = int(os.environ.get("AGENT_HISTORY_MAX_TXNS", "5000"))
+
+# Rows fetched per keyset page when loading history
+AGENT_HISTORY_PAGE_SIZE = int(os.environ.get("AGENT_HISTORY_PAGE_SIZE", "500"))
+
+# Memoized categorizations (distinct merchant/narration/type combos)
+CATEGORY_CACHE_SIZE = int(os.environ.get("CATEGORY_CACHE_SIZE", "65536"))
+
+# Analytics engine for anomalies / prediction / insights: "python" or "numpy"
+AGENT_ENGINE = os.environ.get("AGENT_ENGINE", "python")
+
+# Cross-process run lease: expires unless renewed within this many seconds
+AGENT_LEASE_SECONDS = float(os.environ.get("AGENT_LEASE_SECONDS", "120"))
+
+# Standalone worker: how often it checks the registry for dirty users.
+# The interval stretches up to AGENT_POLL_MAX_SECONDS while idle and
+# drops back to AGENT_POLL_SECONDS as soon as there is a backlog.
+AGENT_POLL_SECONDS = float(os.environ.get("AGENT_POLL_SECONDS", "2"))
+AGENT_POLL_MAX_SECONDS = float(os.environ.get("AGENT_POLL_MAX_SECONDS", "15"))
+
+# Wall-clock budget per scheduler cycle; users past it wait for the next one
+AGENT_CYCLE_BUDGET_SECONDS = float(os.environ.get("AGENT_CYCLE_BUDGET_SECONDS", "2.0"))
+
+# Users synced or viewed within this window are scheduled first
+AGENT_ACTIVE_SECONDS = float(os.environ.get("AGENT_ACTIVE_SECONDS", "3600"))
+
+# Rebuild the shared subscription catalog once it is this old (seconds; 0 = never)
+AGENT_CATALOG_SECONDS = float(os.environ.get("AGENT_CATALOG_SECONDS", "21600"))
+
+# Run the agent inside the API process too (dev convenience, off by default;
+# production runs `python -m app.agent_worker` instead)
+AGENT_EMBEDDED = os.environ.get("AGENT_EMBEDDED", "0") == "1"
+
+# Live anomaly stream (/fiu/stream/{user_id}): events buffered per client
+# before the oldest are dropped, concurrent streams per user, and the
+# keep-alive interval for idle streams (seconds)
+STREAM_BUFFER_SIZE = int(os.environ.get("STREAM_BUFFER_SIZE", "64"))
+STREAM_MAX_CLIENTS_PER_USER = int(os.environ.get("STREAM_MAX_CLIENTS_PER_USER", "4"))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", "15"))
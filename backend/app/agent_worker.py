@@ -0,0 +1,26 @@
+from app.agent.agent_loop import init_agent_db, run_agent_worker
+from app.agent_config import AGENT_POLL_SECONDS
+
+# ------------------------------------------------------------
+# STANDALONE AGENT WORKER
+# ------------------------------------------------------------
+#
+# Runs the agent in its own process so API workers only serve requests.
+# Start as many as you like: the run lease in fiu.db lets exactly one
+# agent run be active at a time.
+#
+#   cd backend
+#   python -m app.agent_worker
+
+def main():
+    init_agent_db()
+    print("[WORKER] Agent worker started.")
+
+    try:
+        run_agent_worker(poll_seconds=AGENT_POLL_SECONDS)
+    except KeyboardInterrupt:
+        print("[WORKER] Stopped.")
+
+
+if __name__ == "__main__":
+    main()
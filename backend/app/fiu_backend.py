@@ -1,11 +1,14 @@
+import json
 import sqlite3
 import threading
 import time
 import uuid
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import requests
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 import os
 from save_win.db import init_savewin_db
 from save_win.endpoints import router as savewin_router
@@ -19,7 +22,19 @@ AA_BASE = "http://localhost:8000/aa"
 CLIENT_ID = "demo"
 CLIENT_SECRET = "demo"
 
-from app.agent.agent_loop import run_agent_once
+from app.agent.agent_loop import run_agent_worker
+from app.agent.anomalies import load_anomalies_since, score_debits
+from app.agent.categorizer import categorize_fields, refresh_rules
+from app.agent.event_bus import anomaly_bus
+from app.agent.insights_writer import load_last_confirmed
+from app.agent.loader import to_epoch_us
+from app.agent.merchants import record_merchants
+from app.agent.metrics import agent_metrics, load_snapshot
+from app.agent.registry import mark_ingested, mark_viewed
+from app.agent.subscriptions import apply_debits
+from app.agent.work_queue import work_queue
+from app.agent_config import AGENT_EMBEDDED, STREAM_BUFFER_SIZE, STREAM_HEARTBEAT_SECONDS
+from app.migrations import migrate
 
 app = FastAPI(title="FIU Backend + Agent")
 
@@ -28,35 +43,8 @@ app = FastAPI(title="FIU Backend + Agent")
 # ------------------------------------------------------------
 
 def init_db():
-    conn = sqlite3.connect(FIU_DB)
-    cur = conn.cursor()
-
-    # Transaction table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            txnId TEXT PRIMARY KEY,
-            userId TEXT,
-            accountId TEXT,
-            amount REAL,
-            txnType TEXT,
-            valueDate TEXT,
-            narration TEXT,
-            merchant TEXT,
-            category TEXT
-        );
-    """)
-
-    # Insights table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS insights (
-            userId TEXT,
-            generatedAt TEXT,
-            insightsJson TEXT
-        );
-    """)
-
-    conn.commit()
-    conn.close()
+    # Tables, indexes and in-place upgrades are versioned in app/migrations.py
+    migrate()
 
 
 init_db()
@@ -190,32 +178,89 @@ def aa_fetch_data(session_id: str):
 # SAVE DATA TO FIU DB
 # ------------------------------------------------------------
 
-def save_fi_data(user_id, fi_response):
+def save_fi_data(user_id, fi_response) -> int:
+    """
+    Stores AA transactions for a user. Returns how many rows were new.
+
+    Each row is categorized here and stamped with the rules version, so
+    the agent only recategorizes after the rules change. New debits also
+    advance the user's persisted subscription state and are scored for
+    anomalies right away. Anomalies no older than the user's previously
+    newest transaction are published to their live streams once stored,
+    as (anomalies rowid, record) pairs; older ones (the first sync's
+    backfill, late-arriving rows) are only stored.
+    """
+    rules = refresh_rules()
+
     conn = sqlite3.connect(FIU_DB)
     cur = conn.cursor()
 
-    for fi in fi_response.get("FI", []):
-        masked = fi["account"]["maskedAccNumber"]
-
-        for t in fi["transactions"]:
-            cur.execute("""
-                INSERT OR IGNORE INTO transactions
-                (txnId, userId, accountId, amount, txnType, valueDate, narration, merchant, category)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                t["txnId"],
-                user_id,
-                masked,
-                t["amount"],
-                t["txnType"],
-                t["valueDate"],
-                t["narration"],
-                t["merchant"],
-                t["category"]
-            ))
-
-    conn.commit()
-    conn.close()
+    inserted = 0
+    debits = []
+    anomalies = []
+
+    try:
+        # Anomalies up to here are history, not news
+        newest = cur.execute(
+            "SELECT MAX(valueTs) FROM transactions WHERE userId = ?", (user_id,)
+        ).fetchone()[0]
+
+        for fi in fi_response.get("FI", []):
+            masked = fi["account"]["maskedAccNumber"]
+
+            for t in fi["transactions"]:
+                value_ts = to_epoch_us(t["valueDate"])
+                if value_ts is None:
+                    print(f"[FIU] WARNING: unparseable valueDate {t['valueDate']!r} in txn "
+                          f"{t['txnId']} for {user_id}; stored but skipped by the agent.")
+                category = categorize_fields(t["merchant"], t["narration"], t["txnType"])
+
+                cur.execute("""
+                    INSERT OR IGNORE INTO transactions
+                    (txnId, userId, accountId, amount, txnType, valueDate, valueTs, narration, merchant,
+                     category, categoryVersion, aaCategory)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    t["txnId"],
+                    user_id,
+                    masked,
+                    t["amount"],
+                    t["txnType"],
+                    t["valueDate"],
+                    value_ts,
+                    t["narration"],
+                    t["merchant"],
+                    category,
+                    rules,
+                    t["category"]
+                ))
+                inserted += cur.rowcount
+
+                if cur.rowcount and t["txnType"] == "DEBIT":
+                    debits.append((float(t["amount"]), category, t["merchant"], t["narration"],
+                                   t["valueDate"], value_ts, t["txnId"]))
+
+        # Only new rows make the user dirty for the agent
+        if inserted:
+            record_merchants(cur, [d[2] for d in debits])
+            apply_debits(cur, user_id, [(d[2], d[5], d[0]) for d in debits])
+            anomalies = score_debits(cur, user_id, debits)
+            if anomalies:
+                print(f"[FIU] {len(anomalies)} anomalies for {user_id} at ingest.")
+            mark_ingested(cur, user_id)
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    live = [(row_id, record) for row_id, ts, record in anomalies if newest is not None and ts >= newest]
+    if live:
+        anomaly_bus.publish(user_id, live)
+
+    return inserted
 
 
 # ------------------------------------------------------------
@@ -239,7 +284,12 @@ def sync_from_aa(user_id: str, vua: str):
     session_id = aa_create_session(consent_id)
     fi_data = aa_fetch_data(session_id)
 
-    save_fi_data(user_id, fi_data)
+    inserted = save_fi_data(user_id, fi_data)
+
+    # Wake the embedded agent for this user only if something new arrived.
+    # A standalone agent worker picks the user up from the registry.
+    if inserted and AGENT_EMBEDDED:
+        work_queue.enqueue(user_id)
 
     return {"message": "Synced successfully", "userId": user_id}
 
@@ -253,10 +303,10 @@ def get_user_transactions(user_id: str):
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT txnId, accountId, amount, txnType, valueDate, narration, merchant, category
+        SELECT txnId, accountId, amount, txnType, valueDate, narration, merchant, category, aaCategory
         FROM transactions
         WHERE userId = ?
-        ORDER BY valueDate DESC
+        ORDER BY valueTs DESC
     """, (user_id,))
 
     rows = cur.fetchall()
@@ -272,6 +322,7 @@ def get_user_transactions(user_id: str):
             "narration": r[5],
             "merchant": r[6],
             "category": r[7],
+            "aaCategory": r[8],
         }
         for r in rows
     ]
@@ -311,6 +362,9 @@ def fetch_insights_for_user(user_id: str) -> List[Dict[str, Any]]:
 
 @app.get("/fiu/insights/{user_id}")
 def get_latest_insights(user_id: str):
+    # Viewed users are refreshed first by the agent scheduler
+    mark_viewed(user_id)
+
     insights_list = fetch_insights_for_user(user_id)
 
     if not insights_list:
@@ -322,7 +376,9 @@ def get_latest_insights(user_id: str):
 
     return {
         "userId": user_id,
-        "latest": insights_list[0]
+        "latest": insights_list[0],
+        # Latest insights may be older than the last run that confirmed them
+        "lastConfirmedAt": load_last_confirmed(user_id)
     }
 
 
@@ -335,22 +391,111 @@ def get_insights_history(user_id: str):
 
 
 # ------------------------------------------------------------
-# BACKGROUND AGENT THREAD
+# LIVE ANOMALY STREAM (Server-Sent Events)
 # ------------------------------------------------------------
 
-def agent_runner():
-    while True:
-        print("[AGENT THREAD] Running agent...")
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.get("/fiu/stream/{user_id}")
+async def stream_anomalies(user_id: str, request: Request):
+    """
+    Pushes anomalies found while ingesting this user's syncs, as they are
+    stored ("anomaly" events, id = the stored anomaly's rowid). Slow
+    clients lose the oldest buffered events and get a "dropped" event
+    with the count; refetch /fiu/insights/{user_id} then. Idle streams
+    get a comment every STREAM_HEARTBEAT_SECONDS.
+
+    A reconnecting client's Last-Event-ID first replays the anomalies
+    stored after it (at most STREAM_BUFFER_SIZE, older ones reported as
+    "dropped"), including those found by other processes' syncs. Live
+    events only come from syncs handled by this API process.
+    """
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None  # new client (or an id we never sent)
+
+    # Subscribe before replaying, so nothing stored in between is missed
+    subscription = anomaly_bus.subscribe(user_id)
+    if subscription is None:
+        raise HTTPException(status_code=429, detail="Too many open streams for this user.")
+
+    async def events():
+        replayed_upto = 0
         try:
-            run_agent_once()
-        except Exception as e:
-            print("[AGENT THREAD] ERROR:", e)
+            yield "retry: 3000\n\n"
+
+            if last_event_id is not None:
+                missed, skipped = await run_in_threadpool(
+                    load_anomalies_since, user_id, last_event_id, STREAM_BUFFER_SIZE)
+                if skipped:
+                    yield _sse("dropped", {"userId": user_id, "dropped": skipped})
+                for event_id, anomaly in missed:
+                    yield _sse("anomaly", {"userId": user_id, **anomaly}, event_id)
+                replayed_upto = missed[-1][0] if missed else last_event_id
+
+            while not await request.is_disconnected():
+                items, dropped = await subscription.get(STREAM_HEARTBEAT_SECONDS)
+
+                if dropped:
+                    yield _sse("dropped", {"userId": user_id, "dropped": dropped})
+
+                for event_id, anomaly in items:
+                    if event_id > replayed_upto:
+                        yield _sse("anomaly", {"userId": user_id, **anomaly}, event_id)
+
+                if not items and not dropped:
+                    yield ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ------------------------------------------------------------
+# AGENT METRICS
+# ------------------------------------------------------------
+
+@app.get("/fiu/metrics")
+def get_agent_metrics():
+    """
+    Per-stage agent timings (count, total, p50/p95/p99 in ms)
+    plus throughput of the last run.
+
+    Served from this process when the agent is embedded, otherwise from
+    the snapshot the agent worker publishes after each run.
+    """
+    if AGENT_EMBEDDED:
+        return agent_metrics.snapshot()
+
+    return load_snapshot() or {"stages": {}, "last_run": None}
 
-        time.sleep(30)  # every 30 seconds
+
+# ------------------------------------------------------------
+# BACKGROUND AGENT THREAD
+# ------------------------------------------------------------
+
+def agent_runner():
+    # Runs on syncs (via work_queue) plus a slow safety-net sweep
+    run_agent_worker(work_queue)
 
 
 @app.on_event("startup")
 def start_background_agent():
+    # By default the agent runs in its own process (python -m app.agent_worker)
+    if not AGENT_EMBEDDED:
+        return
+
     thread = threading.Thread(target=agent_runner, daemon=True)
     thread.start()
     print("[SERVER] Agent thread started.")
@@ -2,10 +2,13 @@ from fastapi import FastAPI
 import sqlite3
 from typing import List, Dict, Any
 import threading
-import time
 from app.db_config import FIU_DB
 
-from app.agent.agent_loop import run_agent_once
+from app.agent.agent_loop import init_agent_db, run_agent_worker
+from app.agent.insights_writer import load_last_confirmed
+from app.agent.registry import mark_viewed
+from app.agent.work_queue import work_queue
+from app.agent_config import AGENT_EMBEDDED
 
 app = FastAPI(title="FIU Backend + Agent")
 
@@ -16,24 +19,23 @@ app = FastAPI(title="FIU Backend + Agent")
 
 def agent_runner():
     """
-    Runs forever, executing agent once every X seconds.
+    Runs forever. This app has no sync endpoint, so nothing is enqueued
+    here and the agent relies on its periodic sweep over dirty users.
     """
-    while True:
-        print("[AGENT THREAD] Running agent...")
-        try:
-            run_agent_once()
-        except Exception as e:
-            print("[AGENT THREAD] Error:", e)
-
-        time.sleep(30)  # run agent every 30 seconds (adjust as needed)
+    run_agent_worker(work_queue)
 
 
 # ------------------------------------------------------------
-# STARTUP EVENT — starts agent on server boot
+# STARTUP EVENT — starts agent on server boot (AGENT_EMBEDDED=1 only;
+# otherwise run python -m app.agent_worker)
 # ------------------------------------------------------------
 
 @app.on_event("startup")
 def start_background_agent():
+    init_agent_db()
+    if not AGENT_EMBEDDED:
+        return
+
     thread = threading.Thread(target=agent_runner, daemon=True)
     thread.start()
     print("[SERVER] Agent thread started.")
@@ -82,6 +84,9 @@ def fetch_insights_for_user(user_id: str) -> List[Dict[str, Any]]:
 
 @app.get("/fiu/insights/{user_id}")
 def get_latest_insights(user_id: str):
+    # Viewed users are refreshed first by the agent scheduler
+    mark_viewed(user_id)
+
     insights_list = fetch_insights_for_user(user_id)
 
     if not insights_list:
@@ -93,7 +98,9 @@ def get_latest_insights(user_id: str):
 
     return {
         "userId": user_id,
-        "latest": insights_list[0]
+        "latest": insights_list[0],
+        # Latest insights may be older than the last run that confirmed them
+        "lastConfirmedAt": load_last_confirmed(user_id)
     }
 
 
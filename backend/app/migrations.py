@@ -0,0 +1,306 @@
+import sqlite3
+from typing import Callable, List, Tuple
+
+from app.agent.anomalies import replay_all_debits
+from app.agent.insights_writer import init_insights_table
+from app.agent.lease import init_lease_table
+from app.agent.loader import init_value_ts
+from app.agent.merchants import rebuild_merchant_canonical
+from app.agent.metrics import init_metrics_table
+from app.agent.registry import init_registry
+from app.agent.subscriptions import rebuild_all_subscription_state
+from app.db_config import FIU_DB
+
+# ------------------------------------------------------------
+# FIU DB SCHEMA MIGRATIONS
+# ------------------------------------------------------------
+#
+# The schema version lives in PRAGMA user_version. Every process calls
+# migrate() at startup; pending steps run in order, each in its own
+# transaction together with the version bump, under BEGIN IMMEDIATE so
+# concurrent starters apply every step exactly once.
+#
+# Append new steps to MIGRATIONS; never edit or reorder shipped ones.
+# Steps must tolerate databases created before versioning existed
+# (user_version 0 with some or all tables already present).
+#
+# Steps only change the schema and never call into the agent modules,
+# whose code keeps changing after a step ships. Derived data that must
+# be recomputed (seeded state, re-keyed merchants) is queued by name in
+# pending_rebuild instead; migrate() runs the queued rebuilds with the
+# current code once the schema is up to date (see REBUILDS).
+
+def _baseline(cur: sqlite3.Cursor):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            txnId TEXT PRIMARY KEY,
+            userId TEXT,
+            accountId TEXT,
+            amount REAL,
+            txnType TEXT,
+            valueDate TEXT,
+            narration TEXT,
+            merchant TEXT,
+            category TEXT,
+            valueTs INTEGER
+        );
+    """)
+
+    # valueDate as epoch microseconds (older DBs are backfilled)
+    init_value_ts(cur)
+
+    # Agent tables: insights, users registry, run lease, metrics snapshot
+    init_insights_table(cur)
+    init_registry(cur)
+    init_lease_table(cur)
+    init_metrics_table(cur)
+
+
+def _hot_query_indexes(cur: sqlite3.Cursor):
+    # Per-user history, newest first: load_transactions, the agent's
+    # keyset pages, /fiu/transactions; also covers DISTINCT userId
+    cur.execute("DROP INDEX IF EXISTS idx_transactions_user_date")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_ts
+        ON transactions (userId, valueTs, txnId);
+    """)
+
+    # fetch_insights_for_user: WHERE userId ORDER BY generatedAt DESC
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_insights_user_generated
+        ON insights (userId, generatedAt);
+    """)
+
+
+def _ingest_categories(cur: sqlite3.Cursor):
+    # category now holds the agent's category, computed at ingest and
+    # stamped with the rules version; the AA-provided label moves to
+    # aaCategory. Existing rows keep a NULL version until recategorized.
+    cur.execute("ALTER TABLE transactions ADD COLUMN aaCategory TEXT")
+    cur.execute("ALTER TABLE transactions ADD COLUMN categoryVersion TEXT")
+    cur.execute("UPDATE transactions SET aaCategory = category")
+
+
+def _backfill_checkpoints(cur: sqlite3.Cursor):
+    # Resume points for long-running backfills (app/recategorize.py)
+    cur.execute("""
+        CREATE TABLE backfill_checkpoint (
+            name TEXT PRIMARY KEY,
+            rulesVersion TEXT,
+            lastRowid INTEGER,
+            updatedAt TEXT
+        );
+    """)
+
+
+def _queue_rebuilds(cur: sqlite3.Cursor, *names: str):
+    cur.executemany(
+        "INSERT OR IGNORE INTO pending_rebuild (name) VALUES (?)",
+        [(name,) for name in names],
+    )
+
+
+def _subscription_state(cur: sqlite3.Cursor):
+    # Running per-(user, merchant) subscription totals, advanced at ingest;
+    # seeded from the stored history
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_state (
+            userId TEXT,
+            merchant TEXT,
+            count INTEGER,
+            lastTs INTEGER,
+            lastAmount REAL,
+            amountSum TEXT,
+            gapDaysSum INTEGER,
+            similar INTEGER,
+            needsRebuild INTEGER DEFAULT 0,
+            PRIMARY KEY (userId, merchant)
+        );
+    """)
+    _queue_rebuilds(cur, "subscription_state")
+
+
+def _canonical_merchants(cur: sqlite3.Cursor):
+    # Raw merchant -> canonical merchant; subscription state is rekeyed
+    # by canonical name
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS merchant_canonical (
+            raw TEXT PRIMARY KEY,
+            canonical TEXT NOT NULL
+        );
+    """)
+    _queue_rebuilds(cur, "merchant_canonical", "subscription_state")
+
+
+def _subscription_catalog(cur: sqlite3.Cursor):
+    # Cross-user merchant catalog (built by app/agent/catalog.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_catalog (
+            merchant TEXT PRIMARY KEY,
+            recurring INTEGER,
+            cycle TEXT,
+            lowAmount REAL,
+            highAmount REAL,
+            userCount INTEGER
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_catalog_build (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            builtAt REAL,
+            merchants INTEGER
+        );
+    """)
+
+
+def _anomaly_stats(cur: sqlite3.Cursor):
+    # Per-(user, category) Welford stats scored at ingest, and the
+    # anomalies found; seeded by replaying the stored history
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS category_stats (
+            userId TEXT,
+            category TEXT,
+            count INTEGER,
+            mean REAL,
+            m2 REAL,
+            needsRebuild INTEGER DEFAULT 0,
+            PRIMARY KEY (userId, category)
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS anomalies (
+            txnId TEXT PRIMARY KEY,
+            userId TEXT,
+            amount REAL,
+            category TEXT,
+            merchant TEXT,
+            narration TEXT,
+            valueDate TEXT,
+            valueTs INTEGER,
+            baselineMean REAL,
+            baselineStd REAL,
+            detectedAt TEXT
+        );
+    """)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_anomalies_user_ts
+        ON anomalies (userId, valueTs);
+    """)
+    _queue_rebuilds(cur, "anomaly_stats")
+
+
+def _merchant_display_names(cur: sqlite3.Cursor):
+    # Narrower merchant normalization: re-key every stored merchant and
+    # rebuild what is keyed by it. Debits per raw spelling pick the
+    # display name; the catalog is rebuilt by the next agent cycle.
+    cur.execute("ALTER TABLE merchant_canonical ADD COLUMN seen INTEGER NOT NULL DEFAULT 0")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_merchant_canonical_canonical
+        ON merchant_canonical (canonical);
+    """)
+    _queue_rebuilds(cur, "merchant_canonical", "subscription_state", "subscription_catalog")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "baseline schema", _baseline),
+    (2, "indexes for per-user queries", _hot_query_indexes),
+    (3, "categories computed at ingest", _ingest_categories),
+    (4, "backfill checkpoints", _backfill_checkpoints),
+    (5, "persisted subscription state", _subscription_state),
+    (6, "canonical merchants", _canonical_merchants),
+    (7, "subscription catalog", _subscription_catalog),
+    (8, "streaming anomaly statistics", _anomaly_stats),
+    (9, "merchant display names", _merchant_display_names),
+]
+
+
+def _clear_catalog(cur: sqlite3.Cursor):
+    cur.execute("DELETE FROM subscription_catalog")
+    cur.execute("DELETE FROM subscription_catalog_build")
+
+
+def _replay_anomaly_stats(cur: sqlite3.Cursor):
+    # Stored anomalies are kept (INSERT OR IGNORE), so their ids stay put
+    cur.execute("DELETE FROM category_stats")
+    replay_all_debits(cur)
+
+
+# Queued rebuilds, in dependency order: subscription state is keyed by
+# canonical merchant
+REBUILDS: List[Tuple[str, Callable[[sqlite3.Cursor], None]]] = [
+    ("merchant_canonical", rebuild_merchant_canonical),
+    ("subscription_state", rebuild_all_subscription_state),
+    ("subscription_catalog", _clear_catalog),
+    ("anomaly_stats", _replay_anomaly_stats),
+]
+
+
+def schema_version(cur: sqlite3.Cursor) -> int:
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _pending_rebuilds(cur: sqlite3.Cursor) -> set:
+    return {row[0] for row in cur.execute("SELECT name FROM pending_rebuild").fetchall()}
+
+
+def migrate(db_path: str = FIU_DB) -> int:
+    """
+    Brings the FIU database up to the latest schema version and returns
+    that version. Refreshes the query planner statistics afterwards.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None  # explicit transactions below
+    cur = conn.cursor()
+
+    applied = rebuilt = 0
+
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS pending_rebuild (
+                name TEXT PRIMARY KEY
+            );
+        """)
+
+        for version, description, step in MIGRATIONS:
+            if schema_version(cur) >= version:
+                continue
+
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while we waited
+                if schema_version(cur) < version:
+                    step(cur)
+                    cur.execute(f"PRAGMA user_version = {int(version)}")
+                    applied += 1
+                    print(f"[DB] Applied migration {version}: {description}")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+        for name, rebuild in REBUILDS:
+            if name not in _pending_rebuilds(cur):
+                continue
+
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have run it while we waited
+                if name in _pending_rebuilds(cur):
+                    rebuild(cur)
+                    cur.execute("DELETE FROM pending_rebuild WHERE name = ?", (name,))
+                    rebuilt += 1
+                    print(f"[DB] Rebuilt {name}")
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+        # Fresh stats after schema or data changes; cheap incremental check otherwise
+        cur.execute("ANALYZE" if applied or rebuilt else "PRAGMA optimize")
+
+        return schema_version(cur)
+    finally:
+        conn.close()
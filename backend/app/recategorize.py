@@ -0,0 +1,199 @@
+import argparse
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from app.agent.anomalies import invalidate_category_stats
+from app.agent.categorizer import categorize_batch, rules_version
+from app.agent.loader import Txn
+from app.agent.registry import mark_stale
+from app.agent_config import AGENT_WORKERS
+from app.db_config import FIU_DB
+from app.migrations import migrate
+
+# ------------------------------------------------------------
+# CATEGORY BACKFILL
+# ------------------------------------------------------------
+#
+# Relabels every transaction whose stored category was computed under
+# other rules (or never), after CATEGORY_KEYWORDS changes:
+#
+#   cd backend
+#   python -m app.recategorize --workers 4
+#
+# Rows are read in rowid order, chunk by chunk, categorized with
+# categorize_batch (in a process pool with --workers > 1) and written
+# back one chunk per short write transaction, so live syncs only ever
+# wait for a single chunk. Progress is checkpointed per rules version;
+# rerunning after an interruption resumes after the last written chunk.
+# Users whose categories changed are marked dirty so the agent
+# recomputes their insights, and their anomaly baselines are rebuilt at
+# their next ingest.
+
+CHECKPOINT = "recategorize"
+
+Row = Tuple[int, str, Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def _load_checkpoint(conn: sqlite3.Connection, version: str) -> int:
+    row = conn.execute(
+        "SELECT rulesVersion, lastRowid FROM backfill_checkpoint WHERE name = ?",
+        (CHECKPOINT,),
+    ).fetchone()
+
+    # A checkpoint from other rules says nothing about these ones
+    if row and row[0] == version:
+        return row[1]
+    return 0
+
+
+def _save_checkpoint(cur: sqlite3.Cursor, version: str, last_rowid: int):
+    cur.execute("""
+        INSERT INTO backfill_checkpoint (name, rulesVersion, lastRowid, updatedAt)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            rulesVersion = excluded.rulesVersion,
+            lastRowid = excluded.lastRowid,
+            updatedAt = excluded.updatedAt;
+    """, (CHECKPOINT, version, last_rowid, datetime.utcnow().isoformat() + "Z"))
+
+
+def _read_chunk(conn: sqlite3.Connection, version: str, after: int, size: int) -> List[Row]:
+    """Next `size` stale rows after rowid `after`, fetched in full."""
+    return conn.execute("""
+        SELECT rowid, userId, merchant, narration, txnType, category
+        FROM transactions
+        WHERE rowid > ? AND (categoryVersion IS NULL OR categoryVersion != ?)
+        ORDER BY rowid
+        LIMIT ?
+    """, (after, version, size)).fetchall()
+
+
+def _categorize_chunk(rows: List[Row]) -> Tuple[str, List[Tuple[int, str, str, bool]]]:
+    """
+    Pool entry point. Returns the rules version it used and, per row,
+    (rowid, userId, category, changed).
+    """
+    txns = [Txn(0.0, txn_type, None, merchant, narration, None)
+            for _, _, merchant, narration, txn_type, _ in rows]
+    categorize_batch(txns)
+
+    results = [
+        (row[0], row[1], t.category, t.category != row[5])
+        for row, t in zip(rows, txns)
+    ]
+    return rules_version(), results
+
+
+def recategorize(
+    chunk_size: int = 2000,
+    workers: int = AGENT_WORKERS,
+    pause: float = 0.05,
+    restart: bool = False
+) -> int:
+    """
+    Runs the backfill to completion and returns the number of rows
+    re-stamped with the current rules. `pause` seconds are left between
+    chunk writes for other writers.
+    """
+    migrate()
+    version = rules_version()
+
+    reader = sqlite3.connect(FIU_DB, timeout=30)
+    writer = sqlite3.connect(FIU_DB, timeout=30)
+    writer.isolation_level = None  # one explicit transaction per chunk
+    cur = writer.cursor()
+
+    after = 0 if restart else _load_checkpoint(reader, version)
+    total = reader.execute("""
+        SELECT COUNT(*) FROM transactions
+        WHERE rowid > ? AND (categoryVersion IS NULL OR categoryVersion != ?)
+    """, (after, version)).fetchone()[0]
+
+    print(f"[BACKFILL] {total} rows to recategorize (rules {version}, "
+          f"resuming after rowid {after}, {workers} worker(s)).")
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    done = 0
+    started = time.perf_counter()
+
+    def submit(rows):
+        if pool is None:
+            return _categorize_chunk(rows)
+        return pool.submit(_categorize_chunk, rows)
+
+    def write(result):
+        nonlocal done
+        used_version, results = result
+        if used_version != version:
+            raise RuntimeError(f"Worker used rules {used_version}, expected {version}")
+
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.executemany(
+                "UPDATE transactions SET category = ?, categoryVersion = ? WHERE rowid = ?",
+                [(category, version, rowid) for rowid, _, category, _ in results],
+            )
+            for user_id in {user_id for _, user_id, _, changed in results if changed}:
+                mark_stale(cur, user_id)
+                invalidate_category_stats(cur, user_id)
+            _save_checkpoint(cur, version, results[-1][0])
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+        done += len(results)
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        print(f"[BACKFILL] {done}/{total} rows ({done * 100 // max(total, 1)}%), "
+              f"{rate:.0f} rows/sec.")
+
+        if pause:
+            time.sleep(pause)
+
+    try:
+        while True:
+            rows = _read_chunk(reader, version, after, chunk_size)
+            if rows:
+                after = rows[-1][0]
+                pending.append(submit(rows))
+
+            # Keep a couple of chunks per worker in flight; write in rowid
+            # order so the checkpoint only ever moves forward
+            while pending and (not rows or pool is None or len(pending) >= workers * 2):
+                head = pending.popleft()
+                write(head if pool is None else head.result())
+
+            if not rows:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        reader.close()
+        writer.close()
+
+    print(f"[BACKFILL] Done: {done} rows in {time.perf_counter() - started:.1f}s.")
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recategorize stored transactions.")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="rows per read/write chunk")
+    parser.add_argument("--workers", type=int, default=AGENT_WORKERS, help="categorizer processes")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between chunk writes")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args(argv)
+
+    try:
+        recategorize(args.chunk_size, args.workers, args.pause, args.restart)
+    except KeyboardInterrupt:
+        print("[BACKFILL] Interrupted; rerun to resume from the checkpoint.")
+
+
+if __name__ == "__main__":
+    main()
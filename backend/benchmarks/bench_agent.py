@@ -0,0 +1,251 @@
+"""
+Agent benchmark suite.
+
+Times every analytics stage on synthetic data, then a full
+run_agent_once against a throwaway SQLite DB, and prints the results
+as JSON so runs can be diffed across commits.
+
+Usage (from backend/):
+    python -m benchmarks.bench_agent --users 500 --txns 200 --out bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List
+
+from benchmarks.synthetic import make_user_transactions, to_agent_format, as_fi_response
+
+
+# ------------------------------------------------------------
+# HELPERS
+# ------------------------------------------------------------
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _time_best(fn: Callable[[], Any], repeat: int) -> float:
+    """Best wall-clock time (seconds) out of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _result(seconds: float, users: int, txns: int) -> Dict[str, float]:
+    return {
+        "seconds": round(seconds, 6),
+        "per_user_ms": round(seconds * 1000 / max(users, 1), 4),
+        "per_txn_us": round(seconds * 1e6 / max(txns, 1), 4),
+    }
+
+
+# ------------------------------------------------------------
+# STAGE BENCHMARKS (pure functions, in memory)
+# ------------------------------------------------------------
+
+def bench_stages(datasets: List[List[Dict[str, Any]]], repeat: int, engine: str = "python") -> Dict[str, Any]:
+    from app.agent.categorizer import categorize_batch
+    from app.agent.subscriptions import detect_subscriptions
+
+    if engine == "numpy":
+        return _bench_numpy_stages(datasets, repeat)
+
+    from app.agent.anomalies import detect_anomalies
+    from app.agent.predictor import predict_future
+    from app.agent.insights import generate_insights
+
+    users = len(datasets)
+    txns = sum(len(d) for d in datasets)
+
+    results = {}
+
+    results["categorize_batch"] = _result(
+        _time_best(lambda: [categorize_batch(d) for d in datasets], repeat), users, txns)
+
+    results["detect_subscriptions"] = _result(
+        _time_best(lambda: [detect_subscriptions(d) for d in datasets], repeat), users, txns)
+
+    results["detect_anomalies"] = _result(
+        _time_best(lambda: [detect_anomalies(d) for d in datasets], repeat), users, txns)
+
+    results["predict_future"] = _result(
+        _time_best(lambda: [predict_future(d) for d in datasets], repeat), users, txns)
+
+    # generate_insights consumes the outputs of the previous stages
+    inputs = [
+        (d, detect_subscriptions(d), detect_anomalies(d), predict_future(d))
+        for d in datasets
+    ]
+    results["generate_insights"] = _result(
+        _time_best(lambda: [generate_insights(*args) for args in inputs], repeat), users, txns)
+
+    return results
+
+
+def _bench_numpy_stages(datasets: List[List[Dict[str, Any]]], repeat: int) -> Dict[str, Any]:
+    from app.agent.categorizer import categorize_batch
+    from app.agent.subscriptions import detect_subscriptions
+    from app.agent import engine_numpy as np_engine
+
+    users = len(datasets)
+    txns = sum(len(d) for d in datasets)
+
+    results = {}
+
+    results["categorize_batch"] = _result(
+        _time_best(lambda: [categorize_batch(d) for d in datasets], repeat), users, txns)
+
+    results["detect_subscriptions"] = _result(
+        _time_best(lambda: [detect_subscriptions(d) for d in datasets], repeat), users, txns)
+
+    # Column building is a cost the python engine doesn't pay; report it
+    results["build_columns"] = _result(
+        _time_best(lambda: [np_engine.TxnColumns.from_txns(d) for d in datasets], repeat), users, txns)
+
+    columns = [np_engine.TxnColumns.from_txns(d) for d in datasets]
+    pairs = list(zip(datasets, columns))
+
+    results["detect_anomalies"] = _result(
+        _time_best(lambda: [np_engine.detect_anomalies(d, c) for d, c in pairs], repeat), users, txns)
+
+    results["predict_future"] = _result(
+        _time_best(lambda: [np_engine.predict_future(d, c) for d, c in pairs], repeat), users, txns)
+
+    inputs = [
+        (d, detect_subscriptions(d), np_engine.detect_anomalies(d, c), np_engine.predict_future(d, c), c)
+        for d, c in pairs
+    ]
+    results["generate_insights"] = _result(
+        _time_best(lambda: [np_engine.generate_insights(*args) for args in inputs], repeat), users, txns)
+
+    return results
+
+
+# ------------------------------------------------------------
+# FULL RUN BENCHMARK (temp DB)
+# ------------------------------------------------------------
+
+def bench_full_run(fi_datasets: List[List[Dict[str, Any]]], workers: int, engine: str = "python") -> Dict[str, Any]:
+    """
+    Seeds a fresh DB via save_fi_data and times run_agent_once over
+    every user. FIU_DB must already point at the temp file.
+    """
+    from app.db_config import FIU_DB
+    from app.fiu_backend import save_fi_data
+    from app.agent.agent_loop import init_agent_db, run_agent_once
+
+    if FIU_DB != os.environ.get("FIU_DB"):
+        raise RuntimeError(f"Refusing to benchmark against {FIU_DB}; FIU_DB was imported too early.")
+
+    init_agent_db()
+
+    users = len(fi_datasets)
+    txns = sum(len(d) for d in fi_datasets)
+
+    started = time.perf_counter()
+    for i, fi_txns in enumerate(fi_datasets):
+        save_fi_data(f"bench-user-{i:06d}", as_fi_response(fi_txns))
+    ingest = time.perf_counter() - started
+
+    # First run: every user is dirty
+    started = time.perf_counter()
+    stats = run_agent_once(workers=workers, engine=engine)
+    cold = time.perf_counter() - started
+
+    # Second run: nothing changed, should be (almost) free
+    started = time.perf_counter()
+    run_agent_once(workers=workers, engine=engine)
+    idle = time.perf_counter() - started
+
+    return {
+        "ingest": _result(ingest, users, txns),
+        "run_agent_once": dict(_result(cold, users, txns), users_per_sec=stats["users_per_sec"]),
+        "run_agent_once_idle": _result(idle, users, txns),
+    }
+
+
+# ------------------------------------------------------------
+# ENTRY
+# ------------------------------------------------------------
+
+def main(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the FIU agent pipeline.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--txns", type=int, default=200, help="transactions per user")
+    parser.add_argument("--days", type=int, default=120, help="history span in days")
+    parser.add_argument("--repeat", type=int, default=3, help="stage repeats (best of)")
+    parser.add_argument("--workers", type=int, default=1, help="agent worker processes")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-full-run", action="store_true")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="fiu-bench-")
+    # Must be set before any app module imports db_config
+    os.environ["FIU_DB"] = os.path.join(tmpdir, "fiu.db")
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    fi_datasets = [make_user_transactions(rng, args.txns, args.days, now) for _ in range(args.users)]
+
+    # Keep the agent's progress prints out of the JSON output
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            datasets = [to_agent_format(d) for d in fi_datasets]
+            results = bench_stages(datasets, args.repeat, args.engine)
+            if not args.skip_full_run:
+                results.update(bench_full_run(fi_datasets, args.workers, args.engine))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": now.isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": args.users,
+            "txns_per_user": args.txns,
+            "days": args.days,
+            "repeat": args.repeat,
+            "workers": args.workers,
+            "engine": args.engine,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+"""
+Categorizer benchmark: compiled keyword matcher vs the original
+nested `kw in blob` loop.
+
+Builds N merchant/narration blobs (mock generator merchants, bank-style
+noise and keyword-free payments), checks both matchers return the same
+category for every blob and prints timings as JSON.
+
+Usage (from backend/):
+    python -m benchmarks.bench_categorizer --count 1000000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+from typing import Dict, Any, List, Optional
+
+from api.mock_generator import SPEND_CATEGORIES
+
+NOISE = ["UPI", "IMPS", "NEFT", "POS", "REF", "TXN", "PAYMENT", "TO", "ONLINE",
+         "TRANSFER", "MR", "SHARMA", "KUMAR", "STORE", "PVT", "LTD"]
+
+
+def make_blobs(rng: random.Random, count: int) -> List[str]:
+    """Upper-cased "MERCHANT NARRATION" blobs, as categorize_transaction builds them."""
+    merchants = [entry for entries in SPEND_CATEGORIES.values() for entry in entries]
+    blobs = []
+
+    for _ in range(count):
+        noise = " ".join(rng.choice(NOISE) for _ in range(rng.randint(1, 4)))
+        ref = rng.randint(100000, 999999)
+
+        if rng.random() < 0.7:
+            merchant, _, narration = rng.choice(merchants)
+            blobs.append(f"{merchant} {noise} {narration} {ref}".upper())
+        else:
+            # P2P transfers and unknown shops: no keyword at all
+            blobs.append(f"{noise} {ref}".upper())
+
+    return blobs
+
+
+def legacy_match(blob: str, rules: Dict[str, List[str]]) -> Optional[str]:
+    """The original categorize_transaction loop."""
+    for category, keywords in rules.items():
+        for kw in keywords:
+            if kw in blob:
+                return category
+    return None
+
+
+def main(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the categorizer matcher.")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    # Keep the db_config banner out of the JSON output
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app.agent.categorizer import CATEGORY_KEYWORDS, match_category
+
+    blobs = make_blobs(random.Random(args.seed), args.count)
+
+    started = time.perf_counter()
+    expected = [legacy_match(blob, CATEGORY_KEYWORDS) for blob in blobs]
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = [match_category(blob) for blob in blobs]
+    compiled = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+
+    report = {
+        "meta": {"count": args.count, "seed": args.seed, "python": sys.version.split()[0]},
+        "results": {
+            "legacy_loop": {"seconds": round(legacy, 4),
+                            "per_blob_us": round(legacy * 1e6 / max(args.count, 1), 3)},
+            "compiled": {"seconds": round(compiled, 4),
+                         "per_blob_us": round(compiled * 1e6 / max(args.count, 1), 3)},
+            "speedup": round(legacy / compiled, 2) if compiled else None,
+            "mismatches": mismatches,
+        },
+    }
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+"""
+Memory comparison: per-row dicts vs slotted Txn records.
+
+Builds N transactions both ways (same values, shared strings) and
+reports traced allocations as JSON.
+
+Usage (from backend/):
+    python -m benchmarks.bench_memory --count 1000000
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List
+
+
+def _measure(build: Callable[[], List[Any]]) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "bytes": current,
+        "bytes_per_txn": round(current / max(len(rows), 1), 1),
+        "build_seconds": round(elapsed, 4),
+    }
+    del rows
+    return result
+
+
+def main(argv=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Compare dict vs Txn memory use.")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    # Keep the db_config banner out of the JSON output
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app.agent.loader import Txn
+
+    # Values created up front so both measurements only count the records
+    base = datetime(2025, 1, 1)
+    dates = [base + timedelta(minutes=i) for i in range(args.count)]
+    amounts = [float(i % 5000) + 0.5 for i in range(args.count)]
+
+    def build_dicts():
+        return [
+            {
+                "amount": amounts[i],
+                "type": "DEBIT",
+                "category": "Food",
+                "merchant": "SWIGGY",
+                "narration": "Food Delivery - Swiggy",
+                "date": dates[i],
+            }
+            for i in range(args.count)
+        ]
+
+    def build_txns():
+        return [
+            Txn(amounts[i], "DEBIT", "Food", "SWIGGY", "Food Delivery - Swiggy", dates[i])
+            for i in range(args.count)
+        ]
+
+    dicts = _measure(build_dicts)
+    txns = _measure(build_txns)
+
+    report = {
+        "meta": {"count": args.count, "python": sys.version.split()[0]},
+        "results": {
+            "dict": dicts,
+            "txn_slots": txns,
+            "saving_ratio": round(dicts["bytes"] / max(txns["bytes"], 1), 2),
+        },
+    }
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+
+from api.mock_generator import SPEND_CATEGORIES
+
+# ------------------------------------------------------------
+# SYNTHETIC TRANSACTIONS (same merchant mix as the mock generator)
+# ------------------------------------------------------------
+
+# Amount ranges per category, as used by mock_generator.get_random_transaction
+AMOUNT_RANGES = {
+    "Food": (150, 900),
+    "Groceries": (200, 2000),
+    "Transport": (80, 2000),
+    "Shopping": (300, 5000),
+    "Bills": (100, 2500),
+    "Subscriptions": (99, 799),
+}
+
+# Monthly recurring debits so subscription detection has work to do
+RECURRING = [
+    ("NETFLIX", "Netflix Subscription", 649.0),
+    ("SPOTIFY", "Spotify Subscription", 119.0),
+    ("YOUTUBE", "YouTube Premium", 129.0),
+]
+
+
+def _fi_txn(rng, merchant, narration, category, amount, txn_type, when, mode="UPI"):
+    return {
+        "txnId": str(uuid.UUID(int=rng.getrandbits(128))),
+        "amount": round(amount, 2),
+        "txnType": txn_type,
+        "valueDate": when.isoformat() + "Z",
+        "narration": narration,
+        "merchant": merchant,
+        "category": category,
+        "mode": mode,
+    }
+
+
+def make_user_transactions(
+    rng: random.Random,
+    count: int,
+    days: int = 120,
+    now: datetime = None
+) -> List[Dict[str, Any]]:
+    """
+    AA-style transactions for one user: random spends across
+    SPEND_CATEGORIES, a monthly salary credit and a few monthly
+    subscriptions, spread over the last `days` days.
+    """
+    now = now or datetime.utcnow()
+    txns = []
+
+    # Salary + subscriptions, once a month
+    for month in range(days // 30 + 1):
+        when = now - timedelta(days=30 * month, hours=rng.randint(0, 12))
+        txns.append(_fi_txn(rng, "ACME PAYROLL", "SALARY CREDIT", "Salary",
+                            rng.uniform(60000, 90000), "CREDIT", when, "NEFT"))
+        for merchant, narration, price in RECURRING:
+            txns.append(_fi_txn(rng, merchant, narration, "Subscriptions",
+                                price, "DEBIT", when - timedelta(days=1), "CARD"))
+
+    categories = list(SPEND_CATEGORIES)
+    while len(txns) < count:
+        category = rng.choice(categories)
+        merchant, mode, narration = rng.choice(SPEND_CATEGORIES[category])
+        low, high = AMOUNT_RANGES[category]
+
+        # ~2% outliers so anomaly detection has something to flag
+        amount = rng.uniform(low, high)
+        if rng.random() < 0.02:
+            amount *= rng.uniform(4, 8)
+
+        when = now - timedelta(days=rng.uniform(0, days))
+        txns.append(_fi_txn(rng, merchant, narration, category, amount, "DEBIT", when, mode))
+
+    return txns[:count]
+
+
+def to_agent_format(fi_txns: List[Dict[str, Any]]) -> list:
+    """
+    Same records load_transactions returns (Txn), newest first.
+    """
+    # Imported lazily: app modules read FIU_DB at import time and the
+    # benchmark has to point it at a temp file first
+    from app.agent.loader import Txn
+
+    txns = [
+        Txn(
+            float(t["amount"]),
+            t["txnType"],
+            t["category"],
+            t["merchant"],
+            t["narration"],
+            datetime.fromisoformat(t["valueDate"][:-1]),
+        )
+        for t in fi_txns
+    ]
+    txns.sort(key=lambda t: t.date, reverse=True)
+    return txns
+
+
+def as_fi_response(fi_txns: List[Dict[str, Any]], account: str = "1234") -> Dict[str, Any]:
+    """
+    Wraps transactions the way the AA fetch endpoint does,
+    ready for save_fi_data.
+    """
+    return {"FI": [{"account": {"maskedAccNumber": account}, "transactions": fi_txns}]}